@@ -0,0 +1,484 @@
+from array import array
+from collections import deque, defaultdict
+from transducer import Transducer, State, Arc, CostVector, PackedCostVector
+from grammar.feature_table import NULL_SEGMENT, JOKER_SEGMENT, Segment
+
+NULL_ID = 0
+JOKER_ID = 1
+
+
+class CompactTransducer:
+    """ An integer-indexed, array-backed transducer.
+
+    States are dense ints with their labels kept in a side table, and arcs are stored column-wise in parallel
+    arrays (origin, input id, output id, terminal and a flat cost row) with a CSR adjacency index, so large
+    product machines do not pay for building, hashing and comparing "a|b|c" label strings.
+    Symbols (segments, and frozensets for set-labelled outputs) are interned into a symbol table in which
+    NULL_SEGMENT and JOKER_SEGMENT always have the ids NULL_ID and JOKER_ID.
+    A Transducer is converted with from_transducer and back with to_transducer; the constraint set intersects its
+    constraint transducers on CompactTransducers when constraint_set.compact_products_flag is set.
+    """
+    __slots__ = ["name", "alphabet", "length_of_cost_vectors", "state_labels", "state_indices", "initial_state",
+                 "final_states", "symbols", "symbol_ids", "arc_origins", "arc_inputs", "arc_outputs", "arc_terminals",
+                 "arc_costs", "_offsets", "_arcs_by_origin"]
+
+    def __init__(self, alphabet, name=None, length_of_cost_vectors=1):
+        self.name = name
+        self.alphabet = alphabet  # contains Segments
+        self.length_of_cost_vectors = length_of_cost_vectors
+        self.state_labels = list()
+        self.state_indices = array('l')
+        self.initial_state = None
+        self.final_states = set()
+        self.symbols = [NULL_SEGMENT, JOKER_SEGMENT]
+        self.symbol_ids = {NULL_SEGMENT: NULL_ID, JOKER_SEGMENT: JOKER_ID}
+        self.arc_origins = array('l')
+        self.arc_inputs = array('l')
+        self.arc_outputs = array('l')
+        self.arc_terminals = array('l')
+        self.arc_costs = array('l')
+        self._offsets = None
+        self._arcs_by_origin = None
+
+    def get_number_of_states(self):
+        return len(self.state_labels)
+
+    def get_number_of_arcs(self):
+        return len(self.arc_origins)
+
+    def get_length_of_cost_vectors(self):
+        return self.length_of_cost_vectors
+
+    def get_states(self):
+        return range(len(self.state_labels))
+
+    def get_final_states(self):
+        return self.final_states
+
+    def add_state(self, label, index=0):
+        self.state_labels.append(label)
+        self.state_indices.append(index)
+        return len(self.state_labels) - 1
+
+    def get_symbol_id(self, symbol):
+        """ Interns a symbol - a Segment or a set of output strings - and returns its id """
+        if isinstance(symbol, (set, frozenset)):
+            symbol = frozenset(symbol)
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbols.append(symbol)
+            self.symbol_ids[symbol] = symbol_id
+        return symbol_id
+
+    def add_arc(self, origin_state, input_id, output_id, costs, terminal_state):
+        self.arc_origins.append(origin_state)
+        self.arc_inputs.append(input_id)
+        self.arc_outputs.append(output_id)
+        self.arc_terminals.append(terminal_state)
+        self.arc_costs.extend(costs)
+        self._offsets = None
+
+    def get_arc_cost(self, arc_id):
+        k = self.length_of_cost_vectors
+        return self.arc_costs[arc_id * k:(arc_id + 1) * k]
+
+    def _build_adjacency(self):
+        """ counting sort of the arc ids by origin state (CSR) """
+        number_of_states = len(self.state_labels)
+        offsets = array('l', [0] * (number_of_states + 1))
+        for origin in self.arc_origins:
+            offsets[origin + 1] += 1
+        for state in range(number_of_states):
+            offsets[state + 1] += offsets[state]
+        position = array('l', offsets[:-1])
+        arcs_by_origin = array('l', [0] * len(self.arc_origins))
+        for arc_id, origin in enumerate(self.arc_origins):
+            arcs_by_origin[position[origin]] = arc_id
+            position[origin] += 1
+        self._offsets = offsets
+        self._arcs_by_origin = arcs_by_origin
+
+    def get_arcs_by_origin_state(self, origin_state):
+        """ returns the ids of the arcs leaving origin_state """
+        if self._offsets is None:
+            self._build_adjacency()
+        return self._arcs_by_origin[self._offsets[origin_state]:self._offsets[origin_state + 1]]
+
+    def clear_dead_states(self, with_impasse_states=False):
+        """ Same contract as Transducer.clear_dead_states. Live states are renumbered densely. """
+        number_of_states = len(self.state_labels)
+        live = bytearray(number_of_states)
+        if self.initial_state is not None:
+            live[self.initial_state] = 1
+            queue = deque([self.initial_state])
+            while queue:
+                state = queue.popleft()
+                for arc_id in self.get_arcs_by_origin_state(state):
+                    terminal = self.arc_terminals[arc_id]
+                    if not live[terminal]:
+                        live[terminal] = 1
+                        queue.append(terminal)
+
+        if with_impasse_states:
+            arcs_by_terminal = [list() for _ in range(number_of_states)]
+            for arc_id, terminal in enumerate(self.arc_terminals):
+                arcs_by_terminal[terminal].append(arc_id)
+            productive = bytearray(number_of_states)
+            queue = deque(state for state in self.final_states if live[state])
+            for state in queue:
+                productive[state] = 1
+            while queue:
+                state = queue.popleft()
+                for arc_id in arcs_by_terminal[state]:
+                    origin = self.arc_origins[arc_id]
+                    if live[origin] and not productive[origin]:
+                        productive[origin] = 1
+                        queue.append(origin)
+            live = productive
+
+        self._keep_states(live)
+
+    def _keep_states(self, live):
+        new_ids = array('l', [-1] * len(self.state_labels))
+        state_labels = list()
+        state_indices = array('l')
+        for state, is_live in enumerate(live):
+            if is_live:
+                new_ids[state] = len(state_labels)
+                state_labels.append(self.state_labels[state])
+                state_indices.append(self.state_indices[state])
+
+        k = self.length_of_cost_vectors
+        arc_origins, arc_inputs, arc_outputs = array('l'), array('l'), array('l')
+        arc_terminals, arc_costs = array('l'), array('l')
+        for arc_id in range(len(self.arc_origins)):
+            origin = new_ids[self.arc_origins[arc_id]]
+            terminal = new_ids[self.arc_terminals[arc_id]]
+            if origin != -1 and terminal != -1:
+                arc_origins.append(origin)
+                arc_inputs.append(self.arc_inputs[arc_id])
+                arc_outputs.append(self.arc_outputs[arc_id])
+                arc_terminals.append(terminal)
+                arc_costs.extend(self.arc_costs[arc_id * k:(arc_id + 1) * k])
+
+        if self.initial_state is not None:
+            self.initial_state = new_ids[self.initial_state] if new_ids[self.initial_state] != -1 else None
+        self.final_states = set(new_ids[state] for state in self.final_states if new_ids[state] != -1)
+        self.state_labels, self.state_indices = state_labels, state_indices
+        self.arc_origins, self.arc_inputs, self.arc_outputs = arc_origins, arc_inputs, arc_outputs
+        self.arc_terminals, self.arc_costs = arc_terminals, arc_costs
+        self._offsets = None
+
+    def get_range(self):
+        """
+        returns a set of strings - the same result as Transducer.get_range (empty when clear_dead_states removed
+        the initial state)
+        """
+        if self.initial_state is None:
+            return set()
+        strings_by_state = [set() for _ in self.state_labels]
+        strings_by_state[self.initial_state].add('')
+        symbol_strings = [self._get_symbol_strings(symbol) for symbol in self.symbols]
+
+        active_states = set([self.initial_state])
+        while active_states:
+            next_pass_states = set()
+            for state in active_states:
+                state_strings = list(strings_by_state[state])
+                for arc_id in self.get_arcs_by_origin_state(state):
+                    terminal_strings = strings_by_state[self.arc_terminals[arc_id]]
+                    next_pass_states.add(self.arc_terminals[arc_id])
+                    for string2 in symbol_strings[self.arc_outputs[arc_id]]:
+                        for string1 in state_strings:
+                            terminal_strings.add(string1 + string2)
+            active_states = next_pass_states
+
+        strings = set()
+        for state in self.final_states:
+            strings.update(strings_by_state[state])
+        return strings
+
+    def _get_symbol_strings(self, symbol):
+        if isinstance(symbol, frozenset):
+            return list(symbol)
+        elif symbol == NULL_SEGMENT:
+            return ['']
+        elif symbol == JOKER_SEGMENT:
+            return [segment.get_symbol() for segment in self.alphabet]
+        else:
+            return [symbol.get_symbol()]
+
+    @classmethod
+    def from_transducer(cls, transducer):
+        """ Converts a Transducer (object model) into a CompactTransducer
+
+        :type transducer: Transducer
+        :rtype: CompactTransducer
+        """
+        compact = cls(transducer.alphabet, name=transducer.name,
+                      length_of_cost_vectors=transducer.length_of_cost_vectors)
+        state_ids = dict()
+        for state in transducer.states:
+            if state not in state_ids:
+                state_ids[state] = compact.add_state(state.label, state.index)
+        compact.initial_state = state_ids[transducer.initial_state]
+        compact.final_states = set(state_ids[state] for state in transducer.final_states)
+        for arc in transducer.get_arcs():
+            compact.add_arc(state_ids[arc.origin_state], compact.get_symbol_id(arc.input),
+                            compact.get_symbol_id(arc.output), arc.cost_vector.vector, state_ids[arc.terminal_state])
+        return compact
+
+    def to_transducer(self):
+        """ Converts back into the object model
+
+        :rtype: Transducer
+        """
+        transducer = Transducer(self.alphabet, name=self.name, length_of_cost_vectors=self.length_of_cost_vectors)
+        states = [State(label, index) for label, index in zip(self.state_labels, self.state_indices)]
+        transducer.states = states
+        if self.initial_state is not None:
+            transducer.initial_state = states[self.initial_state]
+        transducer.final_states = [states[state] for state in sorted(self.final_states)]
+
+        symbols = [_as_arc_label(symbol) for symbol in self.symbols]
+        k = self.length_of_cost_vectors
+        for arc_id in range(len(self.arc_origins)):
+            cost_vector = CostVector(list(self.arc_costs[arc_id * k:(arc_id + 1) * k]))
+            transducer.add_arc(Arc(states[self.arc_origins[arc_id]], symbols[self.arc_inputs[arc_id]],
+                                   symbols[self.arc_outputs[arc_id]], cost_vector, states[self.arc_terminals[arc_id]]))
+        return transducer
+
+    @classmethod
+    def intersection(cls, *transducers):
+        """ Intersects CompactTransducers, exploring only product states reachable from the initial state.
+        Arc costs are concatenated in operand order, as in Transducer.intersection.
+
+        :rtype: CompactTransducer
+        """
+        intersected = transducers[0]
+        for transducer in transducers[1:]:
+            intersected = cls._binary_intersection(intersected, transducer)
+        return intersected
+
+    @classmethod
+    def _binary_intersection(cls, transducer1, transducer2):
+        alphabet = list(set(transducer1.alphabet) | set(transducer2.alphabet))
+        k1 = transducer1.length_of_cost_vectors
+        k2 = transducer2.length_of_cost_vectors
+        transducer = cls(alphabet, length_of_cost_vectors=k1 + k2)
+
+        symbol_map1 = array('l', [transducer.get_symbol_id(symbol) for symbol in transducer1.symbols])
+        symbol_map2 = array('l', [transducer.get_symbol_id(symbol) for symbol in transducer2.symbols])
+        unified_ids = dict()
+
+        def unify(symbol_id1, symbol_id2):
+            key = (symbol_id1, symbol_id2)
+            if key not in unified_ids:
+                unified = Segment.intersect(_as_arc_label(transducer.symbols[symbol_id1]),
+                                            _as_arc_label(transducer.symbols[symbol_id2]))
+                unified_ids[key] = -1 if unified is None else transducer.get_symbol_id(unified)
+            return unified_ids[key]
+
+        product_states = dict()
+
+        def get_product_state(state1, state2):
+            pair = (state1, state2)
+            if pair not in product_states:
+                label = "{0}|{1}".format(transducer1.state_labels[state1], transducer2.state_labels[state2])
+                index = max(transducer1.state_indices[state1], transducer2.state_indices[state2])
+                product_states[pair] = transducer.add_state(label, index)
+                queue.append(pair)
+                if state1 in transducer1.final_states and state2 in transducer2.final_states:
+                    transducer.final_states.add(product_states[pair])
+            return product_states[pair]
+
+        queue = deque()
+        transducer.initial_state = get_product_state(transducer1.initial_state, transducer2.initial_state)
+        while queue:
+            state1, state2 = queue.popleft()
+            origin = product_states[(state1, state2)]
+            arcs2 = transducer2.get_arcs_by_origin_state(state2)
+            for arc1 in transducer1.get_arcs_by_origin_state(state1):
+                input1 = symbol_map1[transducer1.arc_inputs[arc1]]
+                output1 = symbol_map1[transducer1.arc_outputs[arc1]]
+                costs1 = transducer1.arc_costs[arc1 * k1:(arc1 + 1) * k1]
+                for arc2 in arcs2:
+                    unified_input = unify(input1, symbol_map2[transducer2.arc_inputs[arc2]])
+                    if unified_input == -1:
+                        continue
+                    unified_output = unify(output1, symbol_map2[transducer2.arc_outputs[arc2]])
+                    if unified_output == -1:
+                        continue
+                    terminal = get_product_state(transducer1.arc_terminals[arc1], transducer2.arc_terminals[arc2])
+                    transducer.add_arc(origin, unified_input, unified_output,
+                                       costs1 + transducer2.arc_costs[arc2 * k2:(arc2 + 1) * k2], terminal)
+        return transducer
+
+    def get_info(self):
+        return "the transducer has {} arcs and {} states".format(len(self.arc_origins), len(self.state_labels))
+
+    def __str__(self):
+        return str(self.to_transducer())
+
+
+class CompiledGrammarTransducer:
+    """ A grammar transducer compiled for generating the outputs of many words at once.
+
+    States and segments are ints, and the arcs that read a segment from a state are compiled into one row - an
+    array of terminal state ids, the int of the PackedCostVector of every arc, and the output strings of every arc.
+    A row is compiled the first time a word reads it, so a lazy grammar transducer is only asked for the rows that
+    the words need, and the rows are shared by all the words.
+    The words are bucketed by length and every bucket is run through one Viterbi pass that advances all its words a
+    position at a time; the words that share a prefix share the columns of its states and costs.
+    A word whose costs do not fit the packed ints is handed back to make_word_lattice.
+    """
+    __slots__ = ["transducer", "arc_index", "states", "state_ids", "segments", "segment_ids", "final_states",
+                 "guard_mask", "rows"]
+
+    def __init__(self, grammar_transducer):
+        self.transducer = grammar_transducer
+        self.arc_index = grammar_transducer._get_arc_index()
+        self.states = [grammar_transducer.initial_state]
+        self.state_ids = {grammar_transducer.initial_state: 0}
+        self.segments = list(grammar_transducer.get_alphabet())
+        self.segment_ids = {segment.get_symbol(): segment_id for segment_id, segment in enumerate(self.segments)}
+        self.final_states = set(grammar_transducer.get_final_states())
+        self.guard_mask = PackedCostVector._get_guard_mask(grammar_transducer.get_length_of_cost_vectors())
+        self.rows = dict()
+
+    def _get_state_id(self, state):
+        if state not in self.state_ids:
+            self.state_ids[state] = len(self.states)
+            self.states.append(state)
+        return self.state_ids[state]
+
+    def _get_row(self, state_id, segment_id):
+        """ returns (terminal state ids, packed costs, output strings) of the arcs that read the segment from the
+        state, or None when a cost does not fit a packed int """
+        key = (state_id, segment_id)
+        if key not in self.rows:
+            segment = self.segments[segment_id]
+            terminal_ids = array('l')
+            cost_keys = list()
+            output_strings = list()
+            for arc in self.arc_index.get_matching_arcs(self.states[state_id], segment, JOKER_SEGMENT):
+                if Segment.intersect(segment, arc.input) is None:
+                    continue
+                cost_key = arc.cost_vector.get_packed().key
+                if cost_key.__class__ is not int:
+                    self.rows[key] = None
+                    return None
+                terminal_ids.append(self._get_state_id(arc.terminal_state))
+                cost_keys.append(cost_key)
+                output_strings.append(tuple(self.transducer.get_output_strings(arc)))
+            self.rows[key] = (terminal_ids, cost_keys, output_strings)
+        return self.rows[key]
+
+    def get_outputs(self, words):
+        """ returns a dict: word string -> set of the output strings of the word, as Grammar.generate returns """
+        segment_ids_by_length = defaultdict(dict)
+        words_by_string = dict()
+        outputs_by_word = dict()
+        for word in words:
+            segment_ids = tuple(self.segment_ids.get(segment.get_symbol()) for segment in word.get_segments())
+            if None in segment_ids:  # not a word of the alphabet
+                outputs_by_word[str(word)] = _get_lattice_outputs(word, self.transducer)
+            else:
+                segment_ids_by_length[len(segment_ids)][str(word)] = segment_ids
+                words_by_string[str(word)] = word
+
+        for length, segment_ids_by_word in sorted(segment_ids_by_length.items()):
+            columns_by_prefix = self._run_bucket(length, set(segment_ids_by_word.values()))
+            for word_string, segment_ids in segment_ids_by_word.items():
+                outputs = self._get_word_outputs(columns_by_prefix, segment_ids)
+                if outputs is None:
+                    outputs = _get_lattice_outputs(words_by_string[word_string], self.transducer)
+                outputs_by_word[word_string] = outputs
+        return outputs_by_word
+
+    def _run_bucket(self, length, words_segment_ids):
+        """ the Viterbi pass over words of the same length: at every position the prefixes of all the words are
+        advanced by one segment. Returns a dict: prefix -> (state ids, costs, best arcs) of the states the prefix
+        reaches - best arcs lists, for every state, the (index of the origin state in the columns of the prefix
+        without its last segment, output strings) of the arcs that reach it with its cost - or None when the costs
+        of the prefix do not fit the packed ints. """
+        columns_by_prefix = {(): (array('l', [0]), [0], None)}
+        for position in range(length):
+            for prefix in set(segment_ids[:position + 1] for segment_ids in words_segment_ids):
+                columns = columns_by_prefix[prefix[:-1]]
+                columns_by_prefix[prefix] = None if columns is None else self._read_segment(columns, prefix[-1])
+        return columns_by_prefix
+
+    def _read_segment(self, columns, segment_id):
+        state_ids, costs, _ = columns
+        guard_mask = self.guard_mask
+        column_by_state_id = dict()
+        next_state_ids = array('l')
+        next_costs = list()
+        best_arcs = list()
+        for origin, state_id in enumerate(state_ids):
+            row = self._get_row(state_id, segment_id)
+            if row is None:
+                return None
+            cost = costs[origin]
+            terminal_ids, cost_keys, output_strings = row
+            for arc_id, terminal_id in enumerate(terminal_ids):
+                terminal_cost = cost + cost_keys[arc_id]
+                if terminal_cost & guard_mask:
+                    return None
+                column = column_by_state_id.get(terminal_id)
+                if column is None:
+                    column_by_state_id[terminal_id] = len(next_state_ids)
+                    next_state_ids.append(terminal_id)
+                    next_costs.append(terminal_cost)
+                    best_arcs.append([(origin, output_strings[arc_id])])
+                elif terminal_cost < next_costs[column]:
+                    next_costs[column] = terminal_cost
+                    best_arcs[column] = [(origin, output_strings[arc_id])]
+                elif terminal_cost == next_costs[column]:
+                    best_arcs[column].append((origin, output_strings[arc_id]))
+        return next_state_ids, next_costs, best_arcs
+
+    def _get_word_outputs(self, columns_by_prefix, segment_ids):
+        """ the outputs of the optimal paths of the word, collected over the states that are on them """
+        columns_by_position = [columns_by_prefix[segment_ids[:position]] for position in range(len(segment_ids) + 1)]
+        if None in columns_by_position:
+            return None
+        state_ids, costs, _ = columns_by_position[-1]
+        final_columns = [column for column, state_id in enumerate(state_ids)
+                         if self.states[state_id] in self.final_states]
+        if not final_columns:
+            return set()
+        most_harmonic_cost = min(costs[column] for column in final_columns)
+        live_columns = set(column for column in final_columns if costs[column] == most_harmonic_cost)
+        live_columns_by_position = [live_columns]
+        for _, _, best_arcs in reversed(columns_by_position[1:]):
+            live_columns = set(origin for column in live_columns for origin, _ in best_arcs[column])
+            live_columns_by_position.append(live_columns)
+        live_columns_by_position.reverse()
+
+        strings_by_column = {0: set([''])}
+        for position, (_, _, best_arcs) in enumerate(columns_by_position[1:]):
+            next_strings_by_column = dict()
+            for column in live_columns_by_position[position + 1]:
+                strings = set()
+                for origin, output_strings in best_arcs[column]:
+                    for string1 in strings_by_column[origin]:
+                        for string2 in output_strings:
+                            strings.add(string1 + string2)
+                next_strings_by_column[column] = strings
+            strings_by_column = next_strings_by_column
+        return set().union(*strings_by_column.values())
+
+
+def _get_lattice_outputs(word, grammar_transducer):
+    from transducers_optimization_tools import make_word_lattice  # it needs the configurations to be loaded
+    return make_word_lattice(word, grammar_transducer).get_range()
+
+
+def _as_arc_label(symbol):
+    """ symbol table entries hold frozensets, the object model (and Segment.intersect) expects sets """
+    if isinstance(symbol, frozenset):
+        return set(symbol)
+    return symbol
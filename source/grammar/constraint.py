@@ -20,11 +20,41 @@ _all_constraints = list()
 
 constraint_transducers = dict()
 
+# (constraint name, feature table content, ALLOW_CANDIDATES_WITH_CHANGED_SEGMENTS) ->
+# (symbols, skeleton arcs by symbols) of the single-state faithfulness transducers
+faithfulness_skeletons = dict()
+
 
 def get_number_of_constraints():
     return len(_all_constraints)
 
 
+# the cost functions of the arcs of faithfulness skeletons: (arc input, arc output, natural class) -> cost
+def _not_violated(arc_input, arc_output, natural_class):
+    return 0
+
+
+def _violated(arc_input, arc_output, natural_class):
+    return 1
+
+
+def _violated_by_input_in_class(arc_input, arc_output, natural_class):
+    return int(arc_input in natural_class)
+
+
+def _violated_by_output_in_class(arc_input, arc_output, natural_class):
+    return int(arc_output in natural_class)
+
+
+def _violated_by_leaving_class(arc_input, arc_output, natural_class):
+    return int(arc_input in natural_class and arc_output not in natural_class)
+
+
+def _get_feature_table_content(feature_table):
+    return tuple(sorted((symbol, tuple(sorted(feature_table[symbol].items())))
+                        for symbol in feature_table.get_alphabet()))
+
+
 class ConstraintMetaClass(type):
     def __new__(mcs, name, bases, attributes):
         if name != 'NewBase' and name != 'Constraint':  # NewBase is a the name of the base class used
@@ -68,13 +98,40 @@ class Constraint(with_metaclass(ConstraintMetaClass)):
             if getattr(this_module, constraint_class_name).get_constraint_name() == class_name:
                 return getattr(this_module, constraint_class_name)
 
-    def _base_faithfulness_transducer(self):
-        segments = self.feature_table.get_segments()
+    def _make_faithfulness_transducer(self):
+        """ makes a single-state faithfulness transducer (Max, Dep, Ident, Faith) from the arc skeleton of its
+        constraint type in the feature table: only the cost of every arc is computed, from the natural class of the
+        feature bundle """
+        segments, skeleton_arcs = self._get_faithfulness_skeleton()
+        natural_class = self._get_natural_class(segments)
         transducer = Transducer(segments, name=str(self))
         state = State('q0')
         transducer.set_as_single_state(state)
-        return transducer, segments, state
+        for arc_input, arc_output, get_cost in skeleton_arcs:
+            cost_vector = CostVector.get_vector(1, get_cost(arc_input, arc_output, natural_class))
+            transducer.add_arc(Arc(state, arc_input, arc_output, cost_vector, state))
+        return transducer
 
+    def _get_faithfulness_skeleton(self):
+        """ returns the segments of the feature table and the (input, output, cost function) of every arc of the
+        transducers of this constraint type. The arcs are made once per feature table content, by symbols, so a copy
+        of the feature table (as get_hypothesis_copy pickles one) reuses them with its own segments """
+        skeleton_key = (self.get_constraint_name(), _get_feature_table_content(self.feature_table),
+                        configurations["ALLOW_CANDIDATES_WITH_CHANGED_SEGMENTS"])
+        if skeleton_key not in faithfulness_skeletons:
+            skeleton_arcs = self._get_skeleton_arcs(self.feature_table.get_segments())
+            faithfulness_skeletons[skeleton_key] = (self.feature_table.get_alphabet(),
+                                                    [(arc_input.get_symbol(), arc_output.get_symbol(), get_cost)
+                                                     for arc_input, arc_output, get_cost in skeleton_arcs])
+        symbols, symbols_skeleton_arcs = faithfulness_skeletons[skeleton_key]
+        segments = [self.feature_table.get_segment(symbol) for symbol in symbols]
+        segments_by_symbol = dict(zip(symbols, segments))
+        segments_by_symbol[NULL_SEGMENT.get_symbol()] = NULL_SEGMENT
+        return segments, [(segments_by_symbol[input_symbol], segments_by_symbol[output_symbol], get_cost)
+                          for input_symbol, output_symbol, get_cost in symbols_skeleton_arcs]
+
+    def _get_natural_class(self, segments):
+        return {segment for segment in segments if segment.has_feature_bundle(self.feature_bundle)}
 
     @classmethod
     def generate_random(cls, feature_table):
@@ -96,6 +153,9 @@ class Constraint(with_metaclass(ConstraintMetaClass)):
         global constraint_transducers
         constraint_transducers = dict()
 
+        global faithfulness_skeletons
+        faithfulness_skeletons = dict()
+
     def __eq__(self, other):
         if type(self) == type(other):
             return self.feature_bundles == other.feature_bundles
@@ -128,20 +188,21 @@ class MaxConstraint(Constraint):
         self.feature_bundle = self.feature_bundles[0]
 
     def _make_transducer(self):
-        transducer, segments, state = super(MaxConstraint, self)._base_faithfulness_transducer()
+        return self._make_faithfulness_transducer()
+
+    @staticmethod
+    def _get_skeleton_arcs(segments):
+        skeleton_arcs = list()
         for segment in segments:
-            transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
-            transducer.add_arc(Arc(state, NULL_SEGMENT, segment, CostVector.get_vector(1, 0), state))
-            if segment.has_feature_bundle(self.feature_bundle):
-                transducer.add_arc(Arc(state, segment, NULL_SEGMENT, CostVector.get_vector(1, 1), state))
-            else:
-                transducer.add_arc(Arc(state, segment, NULL_SEGMENT, CostVector.get_vector(1, 0), state))
+            skeleton_arcs.append((segment, segment, _not_violated))
+            skeleton_arcs.append((NULL_SEGMENT, segment, _not_violated))
+            skeleton_arcs.append((segment, NULL_SEGMENT, _violated_by_input_in_class))
 
         if configurations["ALLOW_CANDIDATES_WITH_CHANGED_SEGMENTS"]:
             for first_segment, second_segment in permutations(segments, 2):
-                transducer.add_arc(Arc(state, first_segment, second_segment, CostVector.get_vector(1, 0), state))
+                skeleton_arcs.append((first_segment, second_segment, _not_violated))
 
-        return transducer
+        return skeleton_arcs
 
     @classmethod
     def get_constraint_name(cls):
@@ -154,20 +215,21 @@ class DepConstraint(Constraint):
         self.feature_bundle = self.feature_bundles[0]
 
     def _make_transducer(self):
-        transducer, segments, state = super(DepConstraint, self)._base_faithfulness_transducer()
+        return self._make_faithfulness_transducer()
+
+    @staticmethod
+    def _get_skeleton_arcs(segments):
+        skeleton_arcs = list()
         for segment in segments:
-            transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
-            transducer.add_arc(Arc(state, segment, NULL_SEGMENT, CostVector.get_vector(1, 0), state))
-            if segment.has_feature_bundle(self.feature_bundle):
-                transducer.add_arc(Arc(state, NULL_SEGMENT, segment, CostVector.get_vector(1, 1), state))
-            else:
-                transducer.add_arc(Arc(state, NULL_SEGMENT, segment, CostVector.get_vector(1, 0), state))
+            skeleton_arcs.append((segment, segment, _not_violated))
+            skeleton_arcs.append((segment, NULL_SEGMENT, _not_violated))
+            skeleton_arcs.append((NULL_SEGMENT, segment, _violated_by_output_in_class))
 
         if configurations["ALLOW_CANDIDATES_WITH_CHANGED_SEGMENTS"]:
             for first_segment, second_segment in permutations(segments, 2):
-                transducer.add_arc(Arc(state, first_segment, second_segment, CostVector.get_vector(1, 0), state))
+                skeleton_arcs.append((first_segment, second_segment, _not_violated))
 
-        return transducer
+        return skeleton_arcs
 
     @classmethod
     def get_constraint_name(cls):
@@ -180,22 +242,18 @@ class IdentConstraint(Constraint):
         self.feature_bundle = self.feature_bundles[0]
 
     def _make_transducer(self):
-        transducer, segments, state = super(IdentConstraint, self)._base_faithfulness_transducer()
-        for segment in segments:
-            transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
-            transducer.add_arc(Arc(state, segment, NULL_SEGMENT, CostVector.get_vector(1, 0), state))
-            transducer.add_arc(Arc(state, NULL_SEGMENT, segment, CostVector.get_vector(1, 0), state))
-            input_segment = segment
-            if input_segment.has_feature_bundle(self.feature_bundle):
-                for output_segment in segments:
-                    if output_segment.has_feature_bundle(self.feature_bundle):
-                        transducer.add_arc(Arc(state, input_segment, output_segment, CostVector.get_vector(1, 0), state))
-                    else:
-                        transducer.add_arc(Arc(state, input_segment, output_segment, CostVector.get_vector(1, 1), state))
-            else:
-                for output_segment in segments:
-                    transducer.add_arc(Arc(state, input_segment, output_segment, CostVector.get_vector(1, 0), state))
-        return transducer
+        return self._make_faithfulness_transducer()
+
+    @staticmethod
+    def _get_skeleton_arcs(segments):
+        skeleton_arcs = list()
+        for input_segment in segments:
+            skeleton_arcs.append((input_segment, input_segment, _not_violated))
+            skeleton_arcs.append((input_segment, NULL_SEGMENT, _not_violated))
+            skeleton_arcs.append((NULL_SEGMENT, input_segment, _not_violated))
+            for output_segment in segments:
+                skeleton_arcs.append((input_segment, output_segment, _violated_by_leaving_class))
+        return skeleton_arcs
 
     @classmethod
     def get_constraint_name(cls):
@@ -210,18 +268,24 @@ class FaithConstraint(Constraint):
         super(FaithConstraint, self).__init__([], False, feature_table)
 
     def _make_transducer(self):
-        transducer, segments, state = super(FaithConstraint, self)._base_faithfulness_transducer()
+        return self._make_faithfulness_transducer()
+
+    def _get_natural_class(self, segments):
+        return set()
+
+    @staticmethod
+    def _get_skeleton_arcs(segments):
+        skeleton_arcs = list()
         for segment in segments:
-            transducer.add_arc(Arc(state, NULL_SEGMENT, segment, CostVector.get_vector(1, 1), state))
-            transducer.add_arc(Arc(state, segment, NULL_SEGMENT, CostVector.get_vector(1, 1), state))
-            transducer.add_arc(Arc(state, segment, segment, CostVector.get_vector(1, 0), state))
+            skeleton_arcs.append((NULL_SEGMENT, segment, _violated))
+            skeleton_arcs.append((segment, NULL_SEGMENT, _violated))
+            skeleton_arcs.append((segment, segment, _not_violated))
 
         if configurations["ALLOW_CANDIDATES_WITH_CHANGED_SEGMENTS"]:
             for first_segment, second_segment in permutations(segments, 2):
-                transducer.add_arc(Arc(state, first_segment, second_segment, CostVector.get_vector(1, 1), state))
-
-        return transducer
+                skeleton_arcs.append((first_segment, second_segment, _violated))
 
+        return skeleton_arcs
 
     @classmethod
     def get_constraint_name(cls):
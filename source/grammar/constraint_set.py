@@ -2,12 +2,14 @@ from math import ceil, log
 import codecs
 import json
 import logging
-import pickle
+import zlib
 from six import StringIO, PY3
 from random import choice, randrange
 from grammar.constraint import Constraint, get_number_of_constraints
 from grammar.grammar import GrammarParseError
-from transducer import Transducer
+from transducer import Transducer, get_intersection_order
+from compact_transducer import CompactTransducer
+from transducers_optimization_tools import minimize_transducer, get_ranking_permutation
 from randomization_tools import get_weighted_list
 from grammar.constraint import MaxConstraint, DepConstraint, PhonotacticConstraint, IdentConstraint
 from otml_configuration_manager import OtmlConfigurationManager, OtmlConfigurationError
@@ -23,8 +25,28 @@ constraints_delimiter_for_printing = " >> "
 
 constraint_set_transducers = dict()
 
+# the sorted constraint strings -> (the transducer made for these constraints, the constraint strings and the
+# constraint transducers in the order of its costs, the candidate lattices of the segments over its states).
+# Every ranking of the constraints re-ranks that transducer, so they all share the lattices.
+candidate_lattices_by_constraints = dict()
+
 demote_caching_flag = True
 
+permuted_view_flag = True
+
+partial_products_flag = True  # the constraints are intersected as a treap of cached partial products
+
+# a tuple of constraint strings -> (their transducers, the intersection of their transducers)
+partial_products = dict()
+
+minimization_flag = True
+
+compact_products_flag = False  # intersect the constraint transducers as CompactTransducers
+
+join_order_planning_flag = True  # intersect the constraint transducers in the order get_intersection_order plans
+
+number_of_states_before_and_after_minimization = dict()
+
 
 class ConstraintSet:
     def __init__(self, constraint_set_list, feature_table):
@@ -109,7 +131,11 @@ class ConstraintSet:
         if len(self.constraints) > 1:
 
             if demote_caching_flag:
-                transducer = pickle.loads(pickle.dumps(self.get_transducer(), -1))
+                transducer = self.get_transducer()
+                if permuted_view_flag:  # shares the arcs of the transducer instead of copying them
+                    transducer = transducer.get_permuted_view(range(transducer.get_length_of_cost_vectors()))
+                else:
+                    transducer = transducer.clone()
 
             index_of_demotion = randrange(len(self.constraints)-1)  # index of a random constraint
             i = index_of_demotion                                      # (which is not the lowest ranked)
@@ -152,22 +178,83 @@ class ConstraintSet:
         if constraint_set_key in constraint_set_transducers:
             return constraint_set_transducers[constraint_set_key]
         else:
-            transducer = self._make_transducer()
+            transducer = self._get_reranked_transducer() if demote_caching_flag else None
+            if transducer is None:
+                transducer = self._make_transducer()
+                constraints_transducers = [constraint.get_transducer() for constraint in self.constraints]
+                candidate_lattices_by_constraints[self._get_constraints_key()] = \
+                    (transducer, self._get_constraint_names(), constraints_transducers, dict())
             constraint_set_transducers[constraint_set_key] = transducer
             return transducer
 
+    def _get_reranked_transducer(self):
+        """ returns the transducer made for another ranking of these constraints, with its costs ranked as this
+        constraint set ranks them (None when there is no such transducer, or when it was made of other
+        transducers of the constraints) """
+        constraints_key = self._get_constraints_key()
+        if constraints_key not in candidate_lattices_by_constraints:
+            return None
+        transducer, constraint_names, constraints_transducers, _ = candidate_lattices_by_constraints[constraints_key]
+        permutation = get_ranking_permutation(constraint_names, self._get_constraint_names())
+        if not all(constraints_transducers[permutation[i]] is constraint.get_transducer()
+                   for i, constraint in enumerate(self.constraints)):
+            return None
+        reranked_transducer = transducer.get_permuted_view(permutation)
+        if not permuted_view_flag:
+            reranked_transducer.get_arcs()  # makes the permuted arcs
+        return reranked_transducer
+
+    def get_candidate_lattices(self):
+        """ returns the dict in which the grammar keeps the candidate lattices of the segments over this
+        constraint set's transducer. The transducers of the rankings of the same constraints only differ in the
+        order of their cost vectors, so they share the dict (and rank the lattices by their own order of the
+        constraints). A transducer made anew for the constraints (when demote_caching_flag is off) has states of
+        its own, and gets a dict of its own.
+        """
+        transducer = self.get_transducer()
+        origin_transducer, _, _, candidate_lattices = candidate_lattices_by_constraints[self._get_constraints_key()]
+        if transducer.initial_state is not origin_transducer.initial_state:
+            return dict()
+        return candidate_lattices
+
+    def _get_constraint_names(self):
+        return [str(constraint) for constraint in self.constraints]
+
+    def _get_constraints_key(self):
+        return tuple(sorted(self._get_constraint_names()))
+
     def _make_transducer(self):
         if len(self.constraints) == 1:                             # if there is only on constraint in the
-            return pickle.loads(pickle.dumps(self.constraints[0].get_transducer(), -1))  # constraint set there is no need to intersect
+            transducer = self.constraints[0].get_transducer().clone()  # constraint set there is no need to intersect
+        elif partial_products_flag:
+            transducer = _get_partial_product(self.constraints).clone()  # the cached product is not changed
         else:
             constraints_transducers = [constraint.get_transducer() for constraint in self.constraints]
-            return Transducer.intersection(*constraints_transducers)
+            transducer = _intersect(constraints_transducers)
+
+        if minimization_flag:
+            number_of_states = len(transducer.get_states())
+            transducer = minimize_transducer(transducer)
+            number_of_states_before_and_after_minimization[str(self)] = (number_of_states,
+                                                                         len(transducer.get_states()))
+            logger.debug("minimization of %s: %d -> %d states", self, number_of_states, len(transducer.get_states()))
+
+        return transducer
 
     @staticmethod
     def clear_caching():
         global constraint_set_transducers
         constraint_set_transducers = dict()
 
+        global candidate_lattices_by_constraints
+        candidate_lattices_by_constraints = dict()
+
+        global partial_products
+        partial_products = dict()
+
+        global number_of_states_before_and_after_minimization
+        number_of_states_before_and_after_minimization = dict()
+
     @classmethod
     def loads(cls, constraint_set_json_str, feature_table):
         constraint_set_list = json.loads(constraint_set_json_str)
@@ -265,4 +352,49 @@ def _parse_constraint(constraint_string):
     return constraint_dict
 
 
+def _get_partial_product(constraints):
+    """ returns the intersection of the transducers of a run of constraints (in their order).
+    As in a treap, the run is split at the constraint with the highest priority (a hash of its string), and the
+    products of the runs before and after it are cached. The split points depend only on the constraints, not
+    on their positions, so after one constraint is inserted or removed only the O(log n) products on its path
+    are intersected again.
+    """
+    constraints_transducers = [constraint.get_transducer() for constraint in constraints]
+    if len(constraints) == 1:
+        return constraints_transducers[0]
+    constraints_key = tuple(str(constraint) for constraint in constraints)
+    if constraints_key in partial_products:
+        cached_transducers, transducer = partial_products[constraints_key]
+        if all(cached_transducer is constraint_transducer
+               for cached_transducer, constraint_transducer in zip(cached_transducers, constraints_transducers)):
+            return transducer
 
+    root = max(range(len(constraints)), key=lambda i: _get_treap_priority(constraints[i]))
+    components = [constraints_transducers[root]]
+    if root > 0:
+        components.insert(0, _get_partial_product(constraints[:root]))
+    if root < len(constraints) - 1:
+        components.append(_get_partial_product(constraints[root+1:]))
+    transducer = _intersect(components)
+    partial_products[constraints_key] = (constraints_transducers, transducer)
+    return transducer
+
+
+def _intersect(transducers):
+    """ Transducer.intersection of the transducers, made on their CompactTransducers when compact_products_flag is
+    set (the product is the same, with its states and arcs in the order of the pairwise intersections).
+    Otherwise, when join_order_planning_flag is set, they are intersected in the order get_intersection_order plans
+    (see Transducer.intersection_in_order).
+    """
+    if compact_products_flag:
+        compact_transducers = [CompactTransducer.from_transducer(transducer) for transducer in transducers]
+        return CompactTransducer.intersection(*compact_transducers).to_transducer()
+    if join_order_planning_flag:
+        order = get_intersection_order(transducers)
+        if order != sorted(order):
+            return Transducer.intersection_in_order(transducers, order)
+    return Transducer.intersection(*transducers)
+
+
+def _get_treap_priority(constraint):
+    return zlib.crc32(str(constraint).encode("utf-8"))
@@ -2,7 +2,6 @@ import codecs
 import json
 from random import choice
 import logging
-from copy import deepcopy
 import os
 from six import string_types, integer_types, StringIO, iterkeys
 from otml_configuration_manager import OtmlConfigurationManager, OtmlConfigurationError
@@ -23,6 +22,7 @@ class FeatureTable:
         self.feature_table_dict = dict()
         self.feature_types_dict = dict()
         self.segments_list = list()
+        self.segments_by_symbol = dict()  # the canonical Segment of every symbol, shared by words and transducers
         feature_type_list = [dict(**feature) for feature in feature_table_dict_from_json['feature']]
         feature_types_label_in_order = [feature['label'] for feature in feature_table_dict_from_json['feature']]
 
@@ -50,7 +50,9 @@ class FeatureTable:
             self.feature_table_dict[symbol] = symbol_feature_dict
 
         for symbol in self.get_alphabet():
-            self.segments_list.append(Segment(symbol, self))
+            segment = Segment(symbol, self)
+            self.segments_list.append(segment)
+            self.segments_by_symbol[symbol] = segment
 
 
     @classmethod
@@ -100,7 +102,11 @@ class FeatureTable:
         return list(iterkeys(self.feature_table_dict))
 
     def get_segments(self):
-        return deepcopy(self.segments_list)
+        """ the segments are immutable, so the list holds the canonical segments, not copies """
+        return list(self.segments_list)
+
+    def get_segment(self, symbol):
+        return self.segments_by_symbol[symbol]
 
     def get_random_segment(self):
         return choice(self.get_alphabet())
@@ -135,6 +141,9 @@ class FeatureTable:
         return values_str_io.getvalue()
 
 
+    def __deepcopy__(self, memo):
+        return self  # a feature table is not changed once it is loaded, and its segments are interned
+
     def __getitem__(self, item):
         if isinstance(item, string_types):
             return self.feature_table_dict[item]
@@ -194,6 +203,8 @@ class Segment:
         return None
 
     def __eq__(self, other):
+        if self is other:  # the segments of a feature table are interned
+            return True
         if other is None:
             return False
         return self.symbol == other.symbol
@@ -216,6 +227,9 @@ class Segment:
     def __getitem__(self, item):
         return self.feature_dict[item]
 
+    def __deepcopy__(self, memo):
+        return self  # segments are immutable
+
 #----------------------
 #Special segments - required for transducer construction
 NULL_SEGMENT = Segment("-")
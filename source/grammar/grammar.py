@@ -1,8 +1,11 @@
 import logging
+from collections import OrderedDict
 from random import choice
 from grammar.lexicon import Word
 from transducer import Transducer
-from transducers_optimization_tools import optimize_transducer_grammar_for_word, make_optimal_paths
+from compact_transducer import CompiledGrammarTransducer
+from transducers_optimization_tools import optimize_transducer_grammar_for_word, make_optimal_paths, \
+    LazyGrammarTransducer, make_word_lattice, make_word_lattices, iterate_word_lattices
 from randomization_tools import get_weighted_list
 from otml_configuration_manager import OtmlConfigurationManager, OtmlConfigurationError
 from debug_tools import write_to_dot
@@ -18,6 +21,24 @@ outputs_by_constraint_set_and_word = dict()
 
 grammar_transducers = dict()
 
+compiled_grammar_transducers = dict()  # constraint set -> the CompiledGrammarTransducer of its grammar transducer
+
+# [RangeView, strings trie, its outputs selected in the trie]; the least recently used are dropped once there are
+# more than range_views_cache_size of them
+range_views_by_constraint_set_and_word = OrderedDict()
+
+range_views_cache_size = 2000
+
+lazy_grammar_transducer_flag = True  # the arcs of the grammar transducer are computed when a word needs them
+
+word_lattice_flag = True  # walk the word over the grammar transducer instead of intersecting the two
+
+lazy_range_flag = False  # generate returns a RangeView of the outputs instead of a set of strings
+
+candidate_lattices_flag = True  # a re-ranked grammar transducer ranks the candidate lattices of another ranking
+
+compiled_grammar_flag = True  # generate_words runs the new words through a CompiledGrammarTransducer
+
 
 class GrammarParseError(Exception):
     pass
@@ -53,6 +74,17 @@ class Grammar:
 
     def _make_transducer(self):
         constraint_set_transducer = self.constraint_set.get_transducer()
+        if lazy_grammar_transducer_flag:
+            if candidate_lattices_flag:
+                constraint_names = [str(constraint) for constraint in self.constraint_set.constraints]
+                grammar_transducer = LazyGrammarTransducer(constraint_set_transducer, self.feature_table,
+                                                           constraint_names,
+                                                           self.constraint_set.get_candidate_lattices())
+            else:  # reads segments only
+                grammar_transducer = LazyGrammarTransducer(constraint_set_transducer, self.feature_table)
+            grammar_transducer.compute_arcs_in_processes()  # only with parallel_optimal_paths_flag
+            return grammar_transducer
+
         try:
             make_optimal_paths_result = make_optimal_paths(constraint_set_transducer, self.feature_table)
         except Exception as ex:
@@ -62,7 +94,6 @@ class Grammar:
                 pass
                 #write_to_dot(constraint.get_transducer(), str(constraint))
             raise ex
-
         return make_optimal_paths_result
 
     def generate(self, word):
@@ -74,8 +105,105 @@ class Grammar:
             outputs_by_constraint_set_and_word[constraint_set_and_word_key] = outputs
             return outputs
 
+    def generate_words(self, words):
+        """ generate for many words - the words that were not generated yet are run together through the compiled
+        grammar transducer, bucketed by length (or, without compiled_grammar_flag, their lattices are made together
+        by make_word_lattices, which shares the Viterbi pass over their common prefixes)
+
+        :rtype: dict: word string -> outputs
+        """
+        if word_lattice_flag and not lazy_range_flag:
+            words_by_key = {str(self.constraint_set) + str(word): word for word in words}
+            new_words = [word for key, word in words_by_key.items() if key not in outputs_by_constraint_set_and_word]
+            if new_words:
+                if compiled_grammar_flag:
+                    outputs_by_word = self._get_compiled_transducer().get_outputs(new_words)
+                else:
+                    lattices = make_word_lattices(new_words, self.get_transducer())
+                    outputs_by_word = {word_string: lattice.get_range() for word_string, lattice in lattices.items()}
+                for word in new_words:
+                    outputs_by_constraint_set_and_word[str(self.constraint_set) + str(word)] = \
+                        outputs_by_word[str(word)]
+        return {str(word): self.generate(word) for word in words}
+
+    def _get_compiled_transducer(self):
+        """ the CompiledGrammarTransducer of the grammar transducer - its rows are kept for the later words """
+        transducer = self.get_transducer()
+        constraint_set_key = str(self.constraint_set)
+        compiled_transducer = compiled_grammar_transducers.get(constraint_set_key)
+        if compiled_transducer is None or compiled_transducer.transducer is not transducer:
+            compiled_transducer = CompiledGrammarTransducer(transducer)
+            compiled_grammar_transducers[constraint_set_key] = compiled_transducer
+        return compiled_transducer
+
+    def get_range_view(self, word):
+        """ the outputs of word as a RangeView - counted and queried for membership on the word's optimized
+        transducer, without enumerating them """
+        if lazy_range_flag:
+            return self.generate(word)
+        return self._get_range_view_entry(word)[0]
+
+    def select_outputs(self, word, strings_trie):
+        """ returns the RangeView of the outputs of word, and its outputs that are in strings_trie (see
+        RangeView.select_in). The selection is kept with the view, for the last strings trie it was made for.
+        """
+        if lazy_range_flag:
+            range_view = self.generate(word)
+            return range_view, range_view.select_in(strings_trie)
+        range_view_entry = self._get_range_view_entry(word)
+        if range_view_entry[1] is not strings_trie:
+            range_view_entry[1:] = [strings_trie, range_view_entry[0].select_in(strings_trie)]
+        return range_view_entry[0], range_view_entry[2]
+
+    def select_words_outputs(self, words, strings_trie):
+        """ select_outputs for many words - the range views of the words that are not cached are made on the
+        lattices that iterate_word_lattices makes together. Every new view is cached (and its outputs selected) as
+        its lattice comes, so the least recently used views are dropped as the new ones are made.
+
+        :rtype: dict: word -> (RangeView, outputs in strings_trie)
+        """
+        if word_lattice_flag and not lazy_range_flag:
+            constraint_set_key = str(self.constraint_set)
+            new_words = list()
+            for word in set(words):
+                constraint_set_and_word_key = constraint_set_key + str(word)
+                if constraint_set_and_word_key in range_views_by_constraint_set_and_word:
+                    # the most recently used, so that the new views do not push it out
+                    range_views_by_constraint_set_and_word[constraint_set_and_word_key] = \
+                        range_views_by_constraint_set_and_word.pop(constraint_set_and_word_key)
+                else:
+                    new_words.append(word)
+            for word_string, lattice in iterate_word_lattices(new_words, self.get_transducer()):
+                range_view = lattice.get_range_view()
+                # selected as it is made, so the memory of the views it pushes out goes to its selection
+                range_views_by_constraint_set_and_word[constraint_set_key + word_string] = \
+                    [range_view, strings_trie, range_view.select_in(strings_trie)]
+                _drop_least_recently_used_range_views()
+        return {word: self.select_outputs(word, strings_trie) for word in words}
+
+    def _get_range_view_entry(self, word):
+        """ returns the cached [RangeView, strings trie, outputs selected in the trie] of word """
+        constraint_set_and_word_key = str(self.constraint_set) + str(word)
+        if constraint_set_and_word_key in range_views_by_constraint_set_and_word:
+            range_view_entry = range_views_by_constraint_set_and_word.pop(constraint_set_and_word_key)
+        else:
+            range_view_entry = [self._get_optimized_transducer(word).get_range_view(), None, None]
+        range_views_by_constraint_set_and_word[constraint_set_and_word_key] = range_view_entry  # the most recently used
+        _drop_least_recently_used_range_views()
+        return range_view_entry
+
     def _get_outputs(self, word):
+        intersected_transducer = self._get_optimized_transducer(word)
+        if lazy_range_flag:
+            return intersected_transducer.get_range_view()
+        outputs = intersected_transducer.get_range()
+        return outputs
+
+    def _get_optimized_transducer(self, word):
         grammar_transducer = self.get_transducer()
+        if word_lattice_flag:
+            return make_word_lattice(word, grammar_transducer)
+
         word_transducer = word.get_transducer()
         write_to_dot(grammar_transducer, "grammar_transducer")
         write_to_dot(word_transducer, "word_transducer")
@@ -83,9 +211,7 @@ class Grammar:
                                                          grammar_transducer) # a transducer with segments on inputs and sets on outputs
 
         intersected_transducer.clear_dead_states()
-        intersected_transducer = optimize_transducer_grammar_for_word(word, intersected_transducer)
-        outputs = intersected_transducer.get_range()
-        return outputs
+        return optimize_transducer_grammar_for_word(word, intersected_transducer)
 
     def get_all_outputs_grammar(self, new_string_word_list=[]):
         """
@@ -97,8 +223,9 @@ class Grammar:
         else:
             words = self.lexicon.get_words()
 
+        outputs_by_word = self.generate_words(words)
         for word in words:
-            outputs.extend(self._get_outputs(word))
+            outputs.extend(outputs_by_word[str(word)])
 
         return outputs
 
@@ -115,3 +242,14 @@ class Grammar:
 
             global grammar_transducers
             grammar_transducers = dict()
+
+            global compiled_grammar_transducers
+            compiled_grammar_transducers = dict()
+
+            global range_views_by_constraint_set_and_word
+            range_views_by_constraint_set_and_word = OrderedDict()
+
+
+def _drop_least_recently_used_range_views():
+    while len(range_views_by_constraint_set_and_word) > range_views_cache_size:
+        range_views_by_constraint_set_and_word.popitem(last=False)
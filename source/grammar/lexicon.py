@@ -3,7 +3,6 @@ import logging
 from math import log, ceil
 import codecs
 from ast import literal_eval
-from grammar.feature_table import Segment
 from transducer import CostVector, Arc, State, Transducer, NULL_SEGMENT, JOKER_SEGMENT
 from randomization_tools import get_weighted_list
 from otml_configuration_manager import OtmlConfigurationManager, OtmlConfigurationError
@@ -25,7 +24,7 @@ class Word:
         """word_string and segment should be in sync at any time"""
         self.word_string = word_string
         self.feature_table = feature_table
-        self.segments = [Segment(char, self.feature_table) for char in self.word_string]
+        self.segments = [self.feature_table.get_segment(char) for char in self.word_string]
 
     def change_segment(self):
         logging.debug("change_segment")
@@ -63,7 +62,7 @@ class Word:
 
     def _set_word_string(self, new_word_string):
         self.word_string = new_word_string
-        self.segments = [Segment(char, self.feature_table) for char in self.word_string]
+        self.segments = [self.feature_table.get_segment(char) for char in self.word_string]
 
     def get_transducer(self):
         word_key = str(self)
@@ -0,0 +1,69 @@
+#Python2 and Python 3 compatibility:
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import unittest
+
+from tests.otml_configuration_for_testing import configurations
+from transducer import Transducer
+from compact_transducer import CompactTransducer, CompiledGrammarTransducer
+from grammar.feature_table import FeatureTable
+from grammar.lexicon import Word
+from grammar.constraint import PhonotacticConstraint, MaxConstraint, DepConstraint, FaithConstraint
+from transducers_optimization_tools import make_optimal_paths, make_word_lattice, LazyGrammarTransducer
+from tests.persistence_tools import get_feature_table_fixture
+
+
+class TestCompactTransducer(unittest.TestCase):
+
+    def setUp(self):
+        self.feature_table = FeatureTable.load(get_feature_table_fixture("a_b_and_cons_feature_table.json"))
+        self.faith = FaithConstraint([], self.feature_table).get_transducer()
+        self.phonotactic = PhonotacticConstraint([{'cons': '+'}, {'cons': '+'}], self.feature_table).get_transducer()
+        self.max = MaxConstraint([{'cons': '+'}], self.feature_table).get_transducer()
+        self.dep = DepConstraint([{'cons': '-'}], self.feature_table).get_transducer()
+
+    def test_round_trip(self):
+        compact = CompactTransducer.from_transducer(self.phonotactic)
+        self.assertEqual(compact.to_transducer(), self.phonotactic)
+
+    def test_intersection(self):
+        transducers = [self.faith, self.phonotactic, self.max, self.dep]
+        compact_transducers = [CompactTransducer.from_transducer(transducer) for transducer in transducers]
+        intersected = CompactTransducer.intersection(*compact_transducers)
+        self.assertEqual(intersected.to_transducer(), Transducer.intersection(*transducers))
+
+    def test_clear_dead_states_with_impasse_states(self):
+        word_transducer = Word("abb", self.feature_table).get_transducer()
+        transducer = Transducer.intersection(word_transducer, self.phonotactic, self.max)
+        compact = CompactTransducer.from_transducer(transducer)
+        transducer.clear_dead_states(with_impasse_states=True)
+        compact.clear_dead_states(with_impasse_states=True)
+        self.assertEqual(compact.to_transducer(), transducer)
+
+    def test_get_range(self):
+        grammar_transducer = make_optimal_paths(Transducer.intersection(self.faith, self.phonotactic, self.max),
+                                                self.feature_table)
+        word_transducer = Word("abb", self.feature_table).get_transducer()
+        transducer = Transducer.intersection(word_transducer, grammar_transducer)
+        compact = CompactTransducer.from_transducer(transducer)
+        self.assertEqual(compact.get_range(), transducer.get_range())
+
+    def test_get_range_without_initial_state(self):
+        compact = CompactTransducer.from_transducer(self.phonotactic)
+        compact.final_states = set()
+        compact.clear_dead_states(with_impasse_states=True)
+        self.assertIsNone(compact.initial_state)
+        self.assertEqual(compact.get_range(), set())
+
+    def test_compiled_grammar_transducer(self):
+        constraint_set_transducer = Transducer.intersection(self.phonotactic, self.max, self.faith, self.dep)
+        words = [Word(word, self.feature_table) for word in ["abb", "bab", "abab", "bb", "abba", "a", "abb"]]
+        for grammar_transducer in (make_optimal_paths(constraint_set_transducer, self.feature_table),
+                                   LazyGrammarTransducer(constraint_set_transducer, self.feature_table)):
+            compiled_transducer = CompiledGrammarTransducer(grammar_transducer)
+            outputs_by_word = compiled_transducer.get_outputs(words)
+            self.assertEqual(outputs_by_word, {str(word): make_word_lattice(word, grammar_transducer).get_range()
+                                               for word in words})
+            rows = dict(compiled_transducer.rows)
+            compiled_transducer.get_outputs(words[:2])  # the rows are compiled once
+            self.assertEqual(compiled_transducer.rows, rows)
@@ -2,10 +2,12 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import os
+import pickle
 
 from tests.otml_configuration_for_testing import configurations
-from grammar.feature_table import FeatureTable
+from grammar.feature_table import FeatureTable, NULL_SEGMENT
 from grammar.constraint import MaxConstraint, IdentConstraint, PhonotacticConstraint, DepConstraint
+import grammar.constraint as constraint_module
 from grammar.constraint_set import ConstraintSet
 from grammar.grammar import GrammarParseError
 from tests.stochastic_testcase import StochasticTestCase
@@ -76,6 +78,27 @@ class TestConstraint(StochasticTestCase):
                                               num_of_tests=100, possible_result_threshold=10,
                                               all_possible_result_flag=True)
 
+    def test_faithfulness_transducers_share_skeleton(self):
+        max_transducer = MaxConstraint([{'syll': '+'}], self.feature_table)._make_transducer()
+        other_max_transducer = MaxConstraint([{'cons': '+'}], self.feature_table)._make_transducer()
+        self.assertEqual(max_transducer.alphabet, other_max_transducer.alphabet)
+        for transducer, feature in ((max_transducer, 'syll'), (other_max_transducer, 'cons')):
+            for arc in transducer.get_arcs():
+                if arc.output.get_symbol() == NULL_SEGMENT.get_symbol():  # deletion
+                    expected_cost = int(self.feature_table[arc.input.get_symbol()][feature] == '+')
+                    self.assertEqual(arc.cost_vector.vector, [expected_cost])
+
+    def test_faithfulness_skeleton_is_shared_by_feature_table_copies(self):
+        MaxConstraint([{'syll': '+'}], self.feature_table)._make_transducer()
+        number_of_skeletons = len(constraint_module.faithfulness_skeletons)
+        feature_table_copy = pickle.loads(pickle.dumps(self.feature_table, -1))
+        max_transducer = MaxConstraint([{'cons': '+'}], feature_table_copy)._make_transducer()
+        self.assertEqual(len(constraint_module.faithfulness_skeletons), number_of_skeletons)
+        for arc in max_transducer.get_arcs():
+            for segment in (arc.input, arc.output):
+                if segment != NULL_SEGMENT:
+                    self.assertIs(segment, feature_table_copy.get_segment(segment.get_symbol()))
+
     def test_phonotactic_constraint_insert_feature_bundle(self):
         # 11 possible results
         phonotactic_constraint = PhonotacticConstraint([{'syll': '+'}], self.feature_table)
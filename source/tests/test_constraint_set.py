@@ -5,7 +5,12 @@ import os
 
 from tests.otml_configuration_for_testing import configurations
 from grammar.feature_table import FeatureTable
-from grammar.constraint_set import ConstraintSet, _parse_bundle, _parse_bundle_list, _parse_constraint
+import grammar.constraint_set
+from grammar.constraint_set import ConstraintSet, _parse_bundle, _parse_bundle_list, _parse_constraint, \
+    _get_partial_product
+from grammar.lexicon import Word
+from transducer import Transducer
+from transducers_optimization_tools import make_optimal_paths, make_word_lattice
 from tests.stochastic_testcase import StochasticTestCase
 from tests.persistence_tools import get_constraint_set_fixture, get_feature_table_fixture
 
@@ -59,6 +64,30 @@ class TestConstraintSet(StochasticTestCase):
         self.stochastic_object_method_testing(self.constraint_set, "_insert_constraint", possible_results,
                                               num_of_tests=170, possible_result_threshold=1)
 
+    def test_get_partial_product(self):
+        ConstraintSet.clear_caching()
+        constraints = self.constraint_set.constraints
+        self.assertEqual(_get_partial_product(constraints),
+                         Transducer.intersection(*[constraint.get_transducer() for constraint in constraints]))
+
+        cached_products = set(grammar.constraint_set.partial_products)
+        constraints_without_dep = [constraint for constraint in constraints if constraint.get_constraint_name() != "Dep"]
+        self.assertEqual(_get_partial_product(constraints_without_dep),
+                         Transducer.intersection(*[constraint.get_transducer()
+                                                   for constraint in constraints_without_dep]))
+        self.assertLessEqual(len(set(grammar.constraint_set.partial_products) - cached_products), 2)
+
+    def test_make_transducer_with_compact_products(self):
+        ConstraintSet.clear_caching()
+        transducer = self.constraint_set._make_transducer()
+        ConstraintSet.clear_caching()
+        grammar.constraint_set.compact_products_flag = True
+        try:
+            compact_products_transducer = self.constraint_set._make_transducer()
+        finally:
+            grammar.constraint_set.compact_products_flag = False
+        self.assertEqual(compact_products_transducer, transducer)
+
     def test_constraint_set_remove_constraint(self):
 
         dep_deletion = "Constraint Set: Phonotactic[[+cons, +labial][+cons][+cons]] >> Ident[-syll] >> " \
@@ -84,6 +113,25 @@ class TestConstraintSet(StochasticTestCase):
         self.stochastic_object_method_testing(self.constraint_set, "_demote_constraint", possible_results,
                                               num_of_tests=20, possible_result_threshold=1)
 
+    def test_constraint_set_get_transducer_of_another_ranking(self):
+        ConstraintSet.clear_caching()
+        constraint_set_string = str(self.constraint_set).replace("Constraint Set: ", "")
+        reranked_constraint_set_string = " >> ".join(reversed(constraint_set_string.split(" >> ")))
+        reranked_constraint_set = ConstraintSet.load_from_printed_string_representation(
+            reranked_constraint_set_string, self.feature_table)
+
+        transducer = self.constraint_set.get_transducer()
+        reranked_transducer = reranked_constraint_set.get_transducer()
+        self.assertIs(reranked_transducer.initial_state, transducer.initial_state)  # re-ranked, not made anew
+        self.assertIs(reranked_constraint_set.get_candidate_lattices(), self.constraint_set.get_candidate_lattices())
+
+        grammar_transducer = make_optimal_paths(reranked_transducer, self.feature_table)
+        made_grammar_transducer = make_optimal_paths(reranked_constraint_set._make_transducer(), self.feature_table)
+        for string in ["abb", "bba", "abab"]:
+            word = Word(string, self.feature_table)
+            self.assertEqual(make_word_lattice(word, grammar_transducer).get_range(),
+                             make_word_lattice(word, made_grammar_transducer).get_range())
+
     #TODO dependent on value of parameter: params.maxFeatureBundlesInPhonotacticConstraint
     #def test_constraint_set_augment_constraint(self):
     #    old_constraints_list = str(self.constraint_set)
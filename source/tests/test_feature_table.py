@@ -1,11 +1,13 @@
 #Python2 and Python 3 compatibility:
 from __future__ import absolute_import, division, print_function, unicode_literals
 import codecs
+from copy import deepcopy
 
 
 from tests.otml_configuration_for_testing import configurations
 from grammar.feature_table import FeatureTable, FeatureParseError, Segment, FeatureType
 from grammar.feature_bundle import FeatureBundle
+from grammar.lexicon import Word
 from tests.stochastic_testcase import StochasticTestCase
 from tests.persistence_tools import get_feature_table_fixture, get_feature_table_by_fixture
 
@@ -72,6 +74,14 @@ class TestFeatureTable(StochasticTestCase):
         self.assertFalse(segment.has_feature_bundle(FeatureBundle({'son': '+'}, self.feature_table)))
         self.assertFalse(segment.has_feature_bundle(FeatureBundle({'syll': '+', 'son': '+'}, self.feature_table)))
 
+    def test_interned_segments(self):
+        segment = self.feature_table.get_segment('a')
+        self.assertIs(self.feature_table.get_segments()[self.feature_table.get_alphabet().index('a')], segment)
+        self.assertIs(Word("aba", self.feature_table).get_segments()[2], segment)
+        self.assertIs(deepcopy(segment), segment)
+        self.assertIs(deepcopy(self.feature_table), self.feature_table)
+        self.assertEqual(Segment('a', self.feature_table), segment)
+
     #featureType tests:
     def test_feature_type(self):
         feature = FeatureType('syll', ['+', '-'])
@@ -9,7 +9,9 @@ from grammar.feature_table import FeatureTable
 from grammar.constraint_set import ConstraintSet
 from grammar.lexicon import Lexicon
 from grammar.grammar import Grammar
+import grammar.grammar as grammar_module
 from corpus import Corpus
+from transducer import make_strings_trie
 from traversable_grammar_hypothesis import TraversableGrammarHypothesis
 from tests.persistence_tools import get_constraint_set_fixture, get_feature_table_fixture, get_corpus_fixture
 
@@ -43,6 +45,51 @@ class TestingParserSuite(unittest.TestCase):
         self.assertEqual(self.grammar.generate(self.ababa),  {"ababa"})
 
 
+    def test_get_range_view(self):
+        range_view = self.grammar.get_range_view(self.abba)
+        self.assertEqual(len(range_view), 1)
+        self.assertEqual(range_view.select(["bb", "ababa", "abab"]), ["ababa"])
+
+    def test_select_outputs(self):
+        strings_trie = make_strings_trie(["bb", "ababa", "abab"])
+        range_view, outputs = self.grammar.select_outputs(self.abba, strings_trie)
+        self.assertIs(range_view, self.grammar.get_range_view(self.abba))
+        self.assertEqual(outputs, ["ababa"])
+        self.assertIs(self.grammar.select_outputs(self.abba, strings_trie)[1], outputs)  # kept with the view
+        self.assertEqual(self.grammar.select_outputs(self.abba, make_strings_trie(["bab"]))[1], [])
+
+    def test_select_words_outputs(self):
+        strings_trie = make_strings_trie(["bb", "ababa", "abab"])
+        selected_outputs_by_word = self.grammar.select_words_outputs([self.bb, self.bab], strings_trie)
+        for word in (self.bb, self.bab):
+            range_view, outputs = selected_outputs_by_word[word]
+            self.assertIs(range_view, self.grammar.get_range_view(word))  # cached by select_words_outputs
+            self.assertEqual(set(range_view), set(self.grammar._get_optimized_transducer(word).get_range()))
+            self.assertEqual(outputs, self.grammar.select_outputs(word, strings_trie)[1])
+
+        cache_size = grammar_module.range_views_cache_size
+        grammar_module.range_views_cache_size = 2
+        try:
+            range_view = self.grammar.get_range_view(self.bb)
+            self.grammar.get_range_view(self.bab)
+            selected_outputs_by_word = self.grammar.select_words_outputs([self.abba, self.bb], strings_trie)
+            self.assertIs(selected_outputs_by_word[self.bb][0], range_view)  # not pushed out by the view of abba
+        finally:
+            grammar_module.range_views_cache_size = cache_size
+
+    def test_get_range_view_cache_is_bounded(self):
+        cache_size = grammar_module.range_views_cache_size
+        grammar_module.range_views_cache_size = 2
+        try:
+            range_view = self.grammar.get_range_view(self.abba)
+            self.grammar.get_range_view(self.bb)
+            self.assertIs(self.grammar.get_range_view(self.abba), range_view)  # abba is now the most recently used
+            self.grammar.get_range_view(self.bab)
+            self.assertIs(self.grammar.get_range_view(self.abba), range_view)
+            self.assertEqual(len(grammar_module.range_views_by_constraint_set_and_word), 2)
+        finally:
+            grammar_module.range_views_cache_size = cache_size
+
     def test_parser(self):
         traversable_hypothesis = TraversableGrammarHypothesis(self.grammar, ["bb"])
         self.assertEqual(traversable_hypothesis.parse_data(), {'bb': set()})
@@ -5,9 +5,12 @@ import os
 from copy import deepcopy
 
 from tests.otml_configuration_for_testing import configurations
-from transducer import CostVector, Arc, State, Transducer, JOKER_SEGMENT, NULL_SEGMENT, CostVectorOperationError
+from transducer import CostVector, Arc, State, Transducer, JOKER_SEGMENT, NULL_SEGMENT, CostVectorOperationError, \
+    TransducerError, PackedCostVector
+import transducer as transducer_module
 from grammar.feature_table import FeatureTable, Segment
 from grammar.constraint import PhonotacticConstraint, MaxConstraint, IdentConstraint, DepConstraint, FaithConstraint
+from transducer import make_strings_trie
 from tests.persistence_tools import get_pickle, get_feature_table_fixture, write_to_dot_to_file
 
 class TestTransducer(unittest.TestCase):
@@ -84,6 +87,103 @@ class TestTransducer(unittest.TestCase):
     def test_transducer_intersection(self):
         self.assertEqual(self.intersection_test_transducer, get_pickle("intersection_test_transducer"))
 
+    def test_reachable_intersection(self):
+        phonotactic = PhonotacticConstraint([{'cons': '+'}, {'voice': '+'}, {'labial': '+'}],
+                                            self.phonotactic_test_feature_table).get_transducer()
+        dep = DepConstraint([{'labial': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        eager_intersection = Transducer._binary_intersection(phonotactic, dep)
+        eager_intersection.clear_dead_states()
+        self.assertEqual(Transducer._reachable_binary_intersection(phonotactic, dep), eager_intersection)
+
+    def test_nary_intersection(self):
+        phonotactic = PhonotacticConstraint([{'cons': '+'}, {'voice': '+'}, {'labial': '+'}],
+                                            self.phonotactic_test_feature_table).get_transducer()
+        dep = DepConstraint([{'labial': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        max_transducer = MaxConstraint([{'voice': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        eager_intersection = Transducer._binary_intersection(Transducer._binary_intersection(phonotactic, dep),
+                                                             max_transducer)
+        eager_intersection.clear_dead_states()
+        self.assertEqual(Transducer._reachable_nary_intersection([phonotactic, dep, max_transducer]), eager_intersection)
+
+    def test_transducer_clone(self):
+        transducer = self.intersection_test_transducer
+        transducer_before_changes = deepcopy(transducer)
+        clone = transducer.clone()
+        self.assertEqual(clone, transducer)
+
+        clone.swap_weights_on_arcs(0, 1)
+        arc = clone.get_arcs()[0]
+        clone.add_arc(Arc(arc.terminal_state, arc.input, arc.output, arc.cost_vector, arc.origin_state))
+        clone.add_final_state(arc.origin_state)
+        self.assertNotEqual(clone, transducer)
+        self.assertEqual(transducer, transducer_before_changes)
+        self.assertEqual([str(arc.cost_vector) for arc in transducer.get_arcs()],
+                         [str(arc.cost_vector) for arc in transducer_before_changes.get_arcs()])
+
+    def test_transducer_permuted_view(self):
+        phonotactic = PhonotacticConstraint([{'cons': '+'}, {'voice': '+'}, {'labial': '+'}],
+                                            self.phonotactic_test_feature_table).get_transducer()
+        dep = DepConstraint([{'labial': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        max_transducer = MaxConstraint([{'voice': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        faith = FaithConstraint([], self.phonotactic_test_feature_table).get_transducer()
+        transducer = Transducer._reachable_nary_intersection([phonotactic, dep, max_transducer])
+        costs_before_changes = [str(arc.cost_vector) for arc in transducer.get_arcs()]
+        swapped_transducer = transducer.clone()
+        swapped_transducer.swap_weights_on_arcs(0, 1)
+        swapped_transducer.swap_weights_on_arcs(1, 2)
+
+        view = transducer.get_permuted_view([1, 0, 2]).get_permuted_view([0, 2, 1])
+        self.assertEqual(view.permutation, [1, 2, 0])
+        self.assertEqual(Transducer._reachable_nary_intersection([view, faith]),
+                         Transducer._reachable_nary_intersection([swapped_transducer, faith]))
+        self.assertIs(view._arcs, transducer._arcs)  # nothing was copied for the intersection
+
+        self.assertEqual(swapped_transducer, view)  # compares the permuted arcs of the view
+        self.assertIsNone(view.permutation)
+        self.assertEqual(view, swapped_transducer)
+        self.assertEqual([str(arc.cost_vector) for arc in transducer.get_arcs()], costs_before_changes)
+
+    def test_reachable_nary_intersection_with_fused_single_state_transducers(self):
+        faith = FaithConstraint([], self.phonotactic_test_feature_table).get_transducer()
+        dep = DepConstraint([{'labial': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        max_transducer = MaxConstraint([{'voice': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        ident = IdentConstraint([{'voice': '+'}], self.phonotactic_test_feature_table).get_transducer()
+        phonotactic = PhonotacticConstraint([{'cons': '+'}, {'voice': '+'}],
+                                            self.phonotactic_test_feature_table).get_transducer()
+        transducers = [faith, dep.get_permuted_view([0]), phonotactic, max_transducer, ident]
+        self.assertEqual(len(transducer_module._fuse_single_state_runs(transducers)), 3)
+        fused_intersection = Transducer._reachable_nary_intersection(transducers)
+        fused_run = Transducer._reachable_nary_intersection([faith, dep, max_transducer])
+        self.assertEqual([state.label for state in fused_run.states], ["q0|q0|q0"])
+        transducer_module.single_state_fusion_flag = False
+        try:
+            intersection = Transducer._reachable_nary_intersection(transducers)
+            run_intersection = Transducer._reachable_nary_intersection([faith, dep, max_transducer])
+        finally:
+            transducer_module.single_state_fusion_flag = True
+        for fused_transducer, transducer in ((fused_intersection, intersection), (fused_run, run_intersection)):
+            self.assertEqual([str(state) for state in fused_transducer.states],
+                             [str(state) for state in transducer.states])
+            self.assertEqual([str(arc) for arc in fused_transducer.get_arcs()],
+                             [str(arc) for arc in transducer.get_arcs()])
+
+    def test_intersection_in_order(self):
+        faith = FaithConstraint([], self.phonotactic_test_feature_table).get_transducer()
+        dep = DepConstraint([{'labial': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        max_transducer = MaxConstraint([{'voice': '-'}], self.phonotactic_test_feature_table).get_transducer()
+        ident = IdentConstraint([{'voice': '+'}], self.phonotactic_test_feature_table).get_transducer()
+        phonotactic = PhonotacticConstraint([{'cons': '+'}, {'voice': '+'}],
+                                            self.phonotactic_test_feature_table).get_transducer()
+        transducers = [faith, dep, phonotactic, max_transducer, ident]
+        order = transducer_module.get_intersection_order(transducers)
+        self.assertEqual(order, [2, 0, 1, 3, 4])  # the fusable transducers last, so they are fused into one
+        intersection = Transducer.intersection(*transducers)
+        for order in (order, [4, 2, 3, 0, 1], [0, 1, 2, 3, 4]):
+            intersection_in_order = Transducer.intersection_in_order(transducers, order)
+            self.assertEqual(intersection_in_order, intersection)
+            self.assertEqual(sorted(str(arc) for arc in intersection_in_order.get_arcs()),
+                             sorted(str(arc) for arc in intersection.get_arcs()))
+
     def test_transducer_clear_dead_states(self):
         transducer = Transducer(self.feature_table.get_segments())
         state1 = State('q1')
@@ -104,6 +204,23 @@ class TestTransducer(unittest.TestCase):
         transducer.clear_dead_states()
         self.assertEqual(transducer, get_pickle("clear_dead_states_test_transducer"))
 
+    def test_transducer_clear_dead_states_with_impasse_states(self):
+        transducer = Transducer(self.feature_table.get_segments())
+        state1, state2, state3, state4 = State('q1'), State('q2'), State('q3'), State('q4')
+        for state in [state1, state2, state3, state4]:
+            transducer.add_state(state)
+        transducer.initial_state = state1
+        transducer.add_final_state(state2)
+        transducer.add_arc(Arc(state1, JOKER_SEGMENT, NULL_SEGMENT, CostVector([]), state2))
+        transducer.add_arc(Arc(state1, JOKER_SEGMENT, NULL_SEGMENT, CostVector([]), state3))  # state3 is an impasse
+        transducer.add_arc(Arc(state3, JOKER_SEGMENT, NULL_SEGMENT, CostVector([]), state3))
+        transducer.add_arc(Arc(state4, JOKER_SEGMENT, NULL_SEGMENT, CostVector([]), state2))  # state4 is unreachable
+        transducer.clear_dead_states(with_impasse_states=True)
+        self.assertEqual(set(transducer.get_states()), {state1, state2})
+        self.assertEqual(len(transducer.get_arcs()), 1)
+        self.assertEqual(transducer.get_arcs_by_terminal_state(state2), transducer.get_arcs())
+        self.assertEqual(transducer.get_arcs_by_terminal_state(state3), [])
+
     def test_get_arcs_by_origin_state(self):
         initial_state = self.intersection_test_transducer.initial_state
         arc_list = self.intersection_test_transducer.get_arcs_by_origin_state(initial_state)
@@ -119,6 +236,35 @@ class TestTransducer(unittest.TestCase):
     def test_get_range(self):
         pass  # see TestingParserSuite.test_geneare
 
+    def test_get_range_view(self):
+        range_view = self.simple_transducer.get_range_view()
+        self.assertEqual(len(range_view), 1)
+        self.assertIn('b', range_view)
+        self.assertNotIn('a', range_view)
+        self.assertEqual(set(range_view), self.simple_transducer.get_range())
+        self.assertRaises(TransducerError, len, self.loops_transducer.get_range_view())
+
+    def test_range_view_select_in(self):
+        transducer = Transducer(self.feature_table.get_segments())
+        state3 = State('q3')
+        for state in (self.state1, self.state2, state3):
+            transducer.add_state(state)
+        transducer.initial_state = self.state1
+        transducer.add_final_state(state3)
+        transducer.add_arc(Arc(self.state1, Segment('a', self.feature_table), {'a', 'ab', 'bb'}, CostVector([0]),
+                               self.state2))
+        transducer.add_arc(Arc(self.state2, Segment('b', self.feature_table), {'b', ''}, CostVector([0]), state3))
+        range_view = transducer.get_range_view()
+        strings_trie = make_strings_trie(["b", "ab", "abb", "bbb", "aab", "a", "abbb"])
+        listed_strings = set(range_view.select_in(strings_trie))
+        self.assertEqual(listed_strings, {"ab", "abb", "bbb", "a"})
+        listed_range_size = transducer_module.listed_range_size
+        transducer_module.listed_range_size = 0
+        try:
+            self.assertEqual(set(range_view.select_in(strings_trie)), listed_strings)
+        finally:
+            transducer_module.listed_range_size = listed_range_size
+
     #State tests:
     def test_state_str(self):
         self.assertEqual(str(self.state1), "(q1,0)")
@@ -146,6 +292,22 @@ class TestTransducer(unittest.TestCase):
         self.assertFalse(CostVector.get_inf_vector() > CostVector([0, 1, 2]))
         self.assertFalse(CostVector.get_inf_vector() > CostVector.get_inf_vector())
 
+    def test_packedCostVector_comparison_and_addition(self):
+        self.assertTrue(CostVector([0, 0, 0, 0, 0]).get_packed() < CostVector([0, 0, 1, 0, 0]).get_packed())
+        self.assertFalse(CostVector([1, 0, 1]).get_packed() < CostVector([0, 2, 0]).get_packed())
+        self.assertTrue(CostVector([1000, 0, 76]).get_packed() < PackedCostVector.INF)
+        self.assertFalse(PackedCostVector.INF < PackedCostVector.INF)
+        self.assertEqual((self.cost_vector1.get_packed() + self.cost_vector2.get_packed()).unpack(),
+                         CostVector([5, 1, 0]))
+        self.assertIs(self.cost_vector1.get_packed() + PackedCostVector.INF, PackedCostVector.INF)
+
+    def test_packedCostVector_overflow(self):
+        max_count = PackedCostVector.MAX_COUNT
+        overflowing_sum = CostVector([0, max_count]).get_packed() + CostVector([0, 1]).get_packed()
+        self.assertEqual(overflowing_sum.get_counts(), (0, max_count + 1))
+        self.assertTrue(overflowing_sum < CostVector([1, 0]).get_packed())
+        self.assertEqual(overflowing_sum, CostVector([0, max_count + 1]).get_packed())
+
     def test_costVector_get_vector_with_size_n_and_number_m(self):
         self.assertEqual(CostVector.get_vector(4, 0), CostVector([0, 0, 0, 0]))
         self.assertEqual(CostVector.get_vector(1, 1), CostVector([1]))
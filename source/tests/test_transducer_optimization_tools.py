@@ -10,9 +10,12 @@ from six import PY3
 import tests.log_configuration_for_testing
 from tests.otml_configuration_for_testing import configurations
 from tests.persistence_tools import get_pickle
-from transducers_optimization_tools import remove_suboptimal_paths, make_optimal_paths, optimize_transducer_grammar_for_word
+import transducers_optimization_tools
+from transducers_optimization_tools import remove_suboptimal_paths, make_optimal_paths, optimize_transducer_grammar_for_word, \
+    minimize_transducer, LazyGrammarTransducer, make_word_lattice, make_word_lattices, FreeEpenthesisError, \
+    get_ranking_permutation
 from transducer import CostVector, Arc, State, Transducer
-from grammar.constraint import PhonotacticConstraint
+from grammar.constraint import PhonotacticConstraint, DepConstraint, IdentConstraint, MaxConstraint
 from grammar.feature_table import FeatureTable, Segment, NULL_SEGMENT
 from grammar.lexicon import Word
 from tests.persistence_tools import get_feature_table_fixture
@@ -50,6 +53,30 @@ class TestingTransducerOptimizationTools(unittest.TestCase):
         self.assertEqual(self.bb_no_CC_DEP_MAX_removed_suboptimal_paths, get_pickle("bb_no_CC_DEP_MAX_removed_suboptimal_paths"))
 
 
+    def test_remove_suboptimal_paths_keeps_co_optimal_arcs(self):
+        for with_cycle in (False, True):
+            transducer = Transducer(self.feature_table.get_segments(), length_of_cost_vectors=2)
+            q0, q1, q2, q3 = State('q0'), State('q1'), State('q2'), State('q3')
+            for state in (q0, q1, q2, q3):
+                transducer.add_state(state)
+            transducer.initial_state = q0
+            transducer.add_final_state(q3)
+            transducer.add_final_state(q2)
+            co_optimal_arcs = [Arc(q0, Segment('a'), Segment('a'), CostVector([0, 1]), q1),
+                               Arc(q0, Segment('a'), Segment('b'), CostVector([0, 1]), q1),
+                               Arc(q1, Segment('b'), Segment('b'), CostVector([0, 0]), q3)]
+            for arc in co_optimal_arcs:
+                transducer.add_arc(arc)
+            transducer.add_arc(Arc(q0, Segment('a'), NULL_SEGMENT, CostVector([1, 0]), q1))
+            transducer.add_arc(Arc(q1, Segment('b'), Segment('a'), CostVector([0, 0]), q2))
+            if with_cycle:
+                transducer.add_arc(Arc(q1, NULL_SEGMENT, Segment('a'), CostVector([0, 1]), q1))
+
+            transducer = remove_suboptimal_paths(transducer)
+            self.assertEqual(transducer.get_final_states(), [q3])  # q2 is as harmonic, but comes second
+            self.assertEqual(transducer.get_range(), set(['ab', 'bb']))
+            self.assertEqual(set(transducer.get_arcs_by_origin_state(q0)), set(co_optimal_arcs[:2]))
+
     def test_remove_suboptimal_paths_and_clear_dead_states_with_impasse(self):
         self.bb_no_CC_DEP_MAX_removed_suboptimal_paths.clear_dead_states(with_impasse_states=True)
         self.bb_no_CC_DEP_MAX_removed_suboptimal_paths_and_cleared_dead_states = self.bb_no_CC_DEP_MAX_removed_suboptimal_paths
@@ -62,6 +89,103 @@ class TestingTransducerOptimizationTools(unittest.TestCase):
         self.assertEqual(no_CC_MAX_DEP_with_optimal_paths, get_pickle("no_CC_MAX_DEP_with_optimal_paths"))
 
 
+    def test_make_optimal_paths_single_source(self):
+        transducers_optimization_tools.single_source_optimal_paths_flag = False
+        try:
+            transducer_by_state_pairs = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
+        finally:
+            transducers_optimization_tools.single_source_optimal_paths_flag = True
+        transducer = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
+        self.assertEqual(_get_arcs_description(transducer), _get_arcs_description(transducer_by_state_pairs))
+
+    def test_make_optimal_paths_in_processes(self):
+        lazy_transducer = LazyGrammarTransducer(self.no_CC_MAX_DEP, self.feature_table)
+        lazy_transducer.get_arcs_reading(lazy_transducer.initial_state, 'b')
+        transducers_optimization_tools.parallel_optimal_paths_flag = True
+        try:
+            transducer_in_processes = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
+            lazy_transducer_in_processes = LazyGrammarTransducer(self.no_CC_MAX_DEP, self.feature_table)
+            lazy_transducer_in_processes.get_arcs_reading(lazy_transducer.initial_state, 'b')
+            lazy_transducer_in_processes.compute_arcs_in_processes()
+            pool = transducers_optimization_tools._get_optimal_paths_pool()
+        finally:
+            transducers_optimization_tools.parallel_optimal_paths_flag = False
+        self.assertIs(transducers_optimization_tools._get_optimal_paths_pool(), pool)
+        transducer = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
+        self.assertEqual(_get_arcs_description(transducer_in_processes), _get_arcs_description(transducer))
+        self.assertEqual(len(lazy_transducer_in_processes.arcs_by_state_and_symbol),
+                         len(self.feature_table.get_alphabet()) * len(self.no_CC_MAX_DEP.get_states()))
+        self.assertEqual([str(arc) for arc in lazy_transducer_in_processes.get_arcs()],
+                         [str(arc) for arc in lazy_transducer.get_arcs()])  # in the same order
+
+    def test_make_optimal_paths_with_free_epenthesis(self):
+        feature_table = FeatureTable.load(get_feature_table_fixture("full_feature_table.json"))
+        constraints = [DepConstraint([{'labial': '-'}], feature_table), IdentConstraint([{'syll': '-'}], feature_table),
+                       MaxConstraint([{'cons': '-', 'syll': '-'}], feature_table)]
+        transducer = Transducer.intersection(*[constraint._make_transducer() for constraint in constraints])
+        with self.assertRaises(FreeEpenthesisError):  # +labial segments are inserted for free
+            make_optimal_paths(transducer, feature_table)
+        lazy_grammar_transducer = LazyGrammarTransducer(transducer, feature_table)
+        with self.assertRaises(FreeEpenthesisError):
+            lazy_grammar_transducer.get_arcs_reading(transducer.initial_state, feature_table.get_alphabet()[0])
+        transducers_optimization_tools.parallel_optimal_paths_flag = True
+        try:
+            with self.assertRaises(FreeEpenthesisError):
+                make_optimal_paths(transducer, feature_table)
+            lazy_grammar_transducer = LazyGrammarTransducer(transducer, feature_table)
+            lazy_grammar_transducer.compute_arcs_in_processes()
+            with self.assertRaises(FreeEpenthesisError):
+                lazy_grammar_transducer.get_arcs()
+        finally:
+            transducers_optimization_tools.parallel_optimal_paths_flag = False
+
+    def test_lazy_grammar_transducer(self):
+        lazy_transducer = LazyGrammarTransducer(self.no_CC_MAX_DEP, self.feature_table)
+        state = lazy_transducer.initial_state
+        arcs_reading_a = lazy_transducer.get_arcs_reading(state, 'a')
+        self.assertFalse(lazy_transducer.all_arcs_computed)
+        self.assertEqual(len(lazy_transducer.arcs_by_state_and_symbol), 1)
+
+        transducer = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
+        self.assertEqual(sorted(str(arc) for arc in arcs_reading_a),
+                         sorted(str(arc) for arc in transducer.get_arcs_by_origin_state(state)
+                                if arc.input.get_symbol() == 'a'))
+        self.assertEqual(_get_arcs_description(lazy_transducer), _get_arcs_description(transducer))
+        self.assertTrue(lazy_transducer.all_arcs_computed)
+
+    def test_lazy_grammar_transducer_with_candidate_lattices_of_another_ranking(self):
+        candidate_lattices = dict()
+        lazy_transducer = LazyGrammarTransducer(self.no_CC_MAX_DEP, self.feature_table, ["no_CC", "MAX", "DEP"],
+                                                candidate_lattices)
+        lazy_transducer.get_arcs()
+        intersected_machines = {symbol: machine for symbol, (_, _, machine) in candidate_lattices.items()}
+
+        no_CC_DEP_MAX = self.no_CC_MAX_DEP.clone()  # demoting MAX only swaps the weights
+        no_CC_DEP_MAX.swap_weights_on_arcs(1, 2)
+        demoted_lazy_transducer = LazyGrammarTransducer(no_CC_DEP_MAX, self.feature_table, ["no_CC", "DEP", "MAX"],
+                                                        candidate_lattices)
+        transducer = make_optimal_paths(no_CC_DEP_MAX, self.feature_table)
+        self.assertEqual(_get_arcs_description(demoted_lazy_transducer), _get_arcs_description(transducer))
+        for symbol, (_, _, machine) in candidate_lattices.items():
+            self.assertIs(machine, intersected_machines[symbol])
+
+    def test_lazy_grammar_transducer_with_candidate_lattices_of_equally_named_constraints(self):
+        candidate_lattices = dict()
+        lazy_transducer = LazyGrammarTransducer(self.no_CC_MAX_DEP, self.feature_table, ["no_CC", "C", "C"],
+                                                candidate_lattices)
+        lazy_transducer.get_arcs()
+
+        MAX_no_CC_DEP = self.no_CC_MAX_DEP.clone()  # the first C is MAX, the second is DEP
+        MAX_no_CC_DEP.swap_weights_on_arcs(0, 1)
+        demoted_lazy_transducer = LazyGrammarTransducer(MAX_no_CC_DEP, self.feature_table, ["C", "no_CC", "C"],
+                                                        candidate_lattices)
+        transducer = make_optimal_paths(MAX_no_CC_DEP, self.feature_table)
+        self.assertEqual(_get_arcs_description(demoted_lazy_transducer), _get_arcs_description(transducer))
+
+    def test_get_ranking_permutation(self):
+        self.assertEqual(get_ranking_permutation(["a", "b", "c"], ["c", "a", "b"]), [2, 0, 1])
+        self.assertEqual(get_ranking_permutation(["a", "b", "a"], ["a", "a", "b"]), [0, 2, 1])
+
     def test_optimize_transducer_grammar_for_word(self):
         abab = Word("abab", self.feature_table)
         no_CC_MAX_DEP_with_optimal_paths = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
@@ -71,6 +195,53 @@ class TestingTransducerOptimizationTools(unittest.TestCase):
         self.optimized_no_CC_MAX_DEP_for_abab = optimize_transducer_grammar_for_word(abab, new_transducer)
         self.assertEqual(self.optimized_no_CC_MAX_DEP_for_abab, get_pickle("optimized_no_CC_MAX_DEP_for_abab"))
 
+    def test_minimize_transducer(self):
+        transducer = Transducer(self.feature_table.get_segments())
+        even_state, odd_state = State('even'), State('odd')
+        transducer.add_state(even_state)
+        transducer.add_state(odd_state)
+        transducer.initial_state = even_state
+        transducer.add_final_state(even_state)
+        transducer.add_final_state(odd_state)
+        for origin_state, terminal_state in ((even_state, odd_state), (odd_state, even_state)):
+            for arc in self.DEP.get_arcs():
+                transducer.add_arc(Arc(origin_state, arc.input, arc.output, arc.cost_vector, terminal_state))
+
+        minimized_transducer = minimize_transducer(transducer)
+        self.assertEqual(len(minimized_transducer.get_states()), 1)
+        self.assertEqual(len(minimized_transducer.get_arcs()), len(self.DEP.get_arcs()))
+        self.assertEqual(minimize_transducer(deepcopy(self.no_CC_MAX_DEP)), self.no_CC_MAX_DEP)
+
+
+    def test_make_word_lattice(self):
+        abab = Word("abab", self.feature_table)
+        no_CC_MAX_DEP_with_optimal_paths = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
+        intersected_transducer = Transducer.intersection(abab.get_transducer(), no_CC_MAX_DEP_with_optimal_paths)
+        intersected_transducer.clear_dead_states()
+        optimized_transducer = optimize_transducer_grammar_for_word(abab, intersected_transducer)
+
+        lattice = make_word_lattice(abab, no_CC_MAX_DEP_with_optimal_paths)
+        self.assertEqual(_get_arcs_description(lattice), _get_arcs_description(optimized_transducer))
+        self.assertEqual(set(lattice.get_final_states()), set(optimized_transducer.get_final_states()))
+        self.assertEqual(lattice.get_range(), optimized_transducer.get_range())
+
+    def test_make_word_lattices(self):
+        no_CC_MAX_DEP_with_optimal_paths = make_optimal_paths(self.no_CC_MAX_DEP, self.feature_table)
+        words = [Word(string, self.feature_table) for string in ["abab", "aba", "abba", "ba", "abab"]]
+
+        lattices = make_word_lattices(words, no_CC_MAX_DEP_with_optimal_paths)
+        self.assertEqual(set(lattices.keys()), {"abab", "aba", "abba", "ba"})
+        for word in words:
+            lattice = make_word_lattice(word, no_CC_MAX_DEP_with_optimal_paths)
+            self.assertEqual(_get_arcs_description(lattices[str(word)]), _get_arcs_description(lattice))
+            self.assertEqual(set(lattices[str(word)].get_final_states()), set(lattice.get_final_states()))
+            self.assertEqual(lattices[str(word)].get_range(), lattice.get_range())
+
+
+def _get_arcs_description(transducer):
+    return sorted((str(arc.origin_state), str(arc.input), sorted(arc.output), str(arc.cost_vector),
+                   str(arc.terminal_state)) for arc in transducer.get_arcs())
+
 
 def _manually_create_DEP(feature_table):
     """ manually creates a DEP constraint transducer that is featured in Riggle 2004 p.34 fig. 10
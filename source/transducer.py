@@ -2,12 +2,18 @@ from copy import deepcopy
 import functools
 import itertools
 import logging
-from collections import defaultdict
-from six import PY3, StringIO, itervalues
+from collections import defaultdict, deque
+from six import PY3, StringIO, itervalues, iteritems
 from grammar.feature_table import NULL_SEGMENT, JOKER_SEGMENT, Segment
 
 logger = logging.getLogger(__name__)
 
+lazy_intersection_flag = True  # build only the product states that are reachable from the initial state
+
+single_state_fusion_flag = True  # intersect runs of single-state components (Max, Dep, Ident, Faith) by a keyed join
+
+listed_range_size = 16  # RangeView.select_in lists a range of up to this many strings instead of walking it
+
 
 class TransducerError(Exception):
     pass
@@ -15,7 +21,7 @@ class TransducerError(Exception):
 
 class Transducer:
     __slots__ = ["name", "states", "alphabet", "_arcs", "initial_state", "final_states", "arcs_by_state_dict",
-                 "length_of_cost_vectors"]
+                 "origin_states_by_terminal_state_dict", "length_of_cost_vectors", "shared_fields"]
 
     def __init__(self, alphabet, name=None, length_of_cost_vectors=1):
         self.name = name
@@ -25,12 +31,72 @@ class Transducer:
         self.initial_state = None
         self.final_states = list()
         self.arcs_by_state_dict = dict()
+        self.origin_states_by_terminal_state_dict = dict()  # reverse adjacency of arcs_by_state_dict
         self.length_of_cost_vectors = length_of_cost_vectors
+        self.shared_fields = set()  # storage still shared with clones, see clone()
+
+    def clone(self):
+        """ A copy-on-write copy of the transducer: the clone and the original share their state and arc storage
+        until one of them changes it. Methods that change a list or the arcs in place copy only what they touch
+        first, and methods that replace a list (set_final_state, set_arcs, clear_dead_states...) copy nothing.
+        States are immutable and are never copied.
+        """
+        transducer = Transducer(self.alphabet, self.name, self.length_of_cost_vectors)
+        transducer._share_storage_of(self)
+        return transducer
+
+    def _share_storage_of(self, transducer):
+        self.states = transducer.states
+        self._arcs = transducer._arcs
+        self.initial_state = transducer.initial_state
+        self.final_states = transducer.final_states
+        self.arcs_by_state_dict = transducer.arcs_by_state_dict
+        self.origin_states_by_terminal_state_dict = transducer.origin_states_by_terminal_state_dict
+        transducer.shared_fields = set(_SHAREABLE_FIELDS)
+        self.shared_fields = set(_SHAREABLE_FIELDS)
+
+    def get_permuted_view(self, permutation):
+        """ returns a PermutedTransducer: this transducer with its costs read through permutation (the i-th cost of
+        the view is the permutation[i]-th cost of this transducer), made without copying the arcs """
+        return PermutedTransducer(self, permutation)
+
+    def get_arc_cost_vector(self, arc):
+        """ the cost vector of one of the arcs, as this transducer reads it (see PermutedTransducer) """
+        return arc.cost_vector
+
+    def _unshare(self, field):
+        if field not in self.shared_fields:
+            return
+        self.shared_fields.discard(field)
+        if field == "states":
+            self.states = list(self.states)
+        elif field == "final_states":
+            self.final_states = list(self.final_states)
+        elif field == "arc_lists":
+            self._arcs = list(self._arcs)
+            self.arcs_by_state_dict = {origin_state: {terminal_state: list(arcs)
+                                                      for terminal_state, arcs in iteritems(arcs_by_terminal_state)}
+                                       for origin_state, arcs_by_terminal_state in iteritems(self.arcs_by_state_dict)}
+            self.origin_states_by_terminal_state_dict = {terminal_state: set(origin_states)
+                                                         for terminal_state, origin_states
+                                                         in iteritems(self.origin_states_by_terminal_state_dict)}
+        elif field == "arcs":  # the Arc objects (and their cost vectors) themselves
+            cost_vectors_copies = dict()  # a cost vector shared by several arcs stays shared in the copy
+            arcs = list()
+            for arc in self._arcs:
+                cost_vector = arc.cost_vector
+                if id(cost_vector) not in cost_vectors_copies:
+                    cost_vectors_copies[id(cost_vector)] = CostVector(list(cost_vector.vector))
+                arcs.append(Arc(arc.origin_state, arc.input, arc.output, cost_vectors_copies[id(cost_vector)],
+                                arc.terminal_state))
+            self.set_arcs(arcs)
+            self.shared_fields.discard("arcs")
 
     def set_as_single_state(self, state):
         self.initial_state = state
         self.final_states = [state]
         self.states = [state]
+        self.shared_fields.difference_update(("states", "final_states"))
 
     def get_states(self):
         return self.states
@@ -39,6 +105,7 @@ class Transducer:
         return self.alphabet
 
     def add_state(self, state):
+        self._unshare("states")
         self.states.append(state)
 
     def get_final_states(self):
@@ -49,18 +116,26 @@ class Transducer:
 
     def set_final_state(self, state):  # sets a single state as final state
         self.final_states = [state]
+        self.shared_fields.discard("final_states")
 
     def add_final_state(self, state):
+        self._unshare("final_states")
         self.final_states.append(state)
 
     def get_arcs(self):
         return self._arcs
 
     def remove_arc(self, arc):
-        self.arcs_by_state_dict[arc.origin_state][arc.terminal_state].remove(arc)
+        self._unshare("arc_lists")
+        arcs_between_states = self.arcs_by_state_dict[arc.origin_state][arc.terminal_state]
+        arcs_between_states.remove(arc)
+        if not arcs_between_states:
+            del self.arcs_by_state_dict[arc.origin_state][arc.terminal_state]
+            self.origin_states_by_terminal_state_dict[arc.terminal_state].discard(arc.origin_state)
         self._arcs.remove(arc)
 
     def add_arc(self, arc):
+        self._unshare("arc_lists")
         if arc.origin_state not in self.arcs_by_state_dict:
             self.arcs_by_state_dict[arc.origin_state] = dict()
         if arc.terminal_state not in self.arcs_by_state_dict[arc.origin_state]:
@@ -68,6 +143,10 @@ class Transducer:
 
         self.arcs_by_state_dict[arc.origin_state][arc.terminal_state].append(arc)
 
+        if arc.terminal_state not in self.origin_states_by_terminal_state_dict:
+            self.origin_states_by_terminal_state_dict[arc.terminal_state] = set()
+        self.origin_states_by_terminal_state_dict[arc.terminal_state].add(arc.origin_state)
+
         self._arcs.append(arc)
 
     def clear_dead_states(self, with_impasse_states = False):
@@ -76,78 +155,47 @@ class Transducer:
         a state that cannot be reached from the initial state by following any path  (unreachable state)
         or
         a state that cannot reach a final state by following any path (impasse state)
-        """
-        #logger.debug("clear_dead_states: transducer before: %s", self)
-        #clear unreachable states:
-        state_unreachable_dict = {state: True for state in self.states}  # all states are unreachable at first
-        state_unreachable_dict[self.initial_state] = False               # except for initial state
-
-        while True:    # "do while" loop
-            change_in_dict = False
-            for arc in self._arcs:
-                if not state_unreachable_dict[arc.origin_state] and state_unreachable_dict[arc.terminal_state]:
-                    state_unreachable_dict[arc.terminal_state] = False
-                    change_in_dict = True
-
-            if not change_in_dict:
-                break
-
-        unreachable_states = [state for state in state_unreachable_dict if state_unreachable_dict[state]]
-
-
-        # remove arcs from arcs_by_state_dict
-        for state in unreachable_states:
-             self.arcs_by_state_dict.pop(state, None)  #TODO add None for Yimas
-
-        for origin_state in self.arcs_by_state_dict.keys():  #TODO maybe we don't need this due to the nature of cliques
-            for state in unreachable_states:
-                self.arcs_by_state_dict[origin_state].pop(state, None)
-
-        #remove arcs for _arcs
-        self._arcs[:] = [arc for arc in self._arcs if ((arc.origin_state not in unreachable_states) and
-                                                        (arc.terminal_state not in unreachable_states))]
-
-        #remove states
-        self.states[:] = [state for state in self.states if state not in unreachable_states]
-        self.final_states[:] = [state for state in self.final_states if state not in unreachable_states]
 
+        Both are found with a single traversal - forwards over arcs_by_state_dict from the initial state, and
+        backwards over origin_states_by_terminal_state_dict from the final states.
+        """
+        reachable_states = self._get_connected_states([self.initial_state], self.arcs_by_state_dict)
+        self._keep_states(reachable_states)
 
         if with_impasse_states:
-            #clear impasse states:
-            state_impasse_dict = {state: True for state in self.states}  # all states are impasse at first
-            for final_state in self.final_states:                         # except for the final states
-                state_impasse_dict[final_state] = False
-
-            while True:    # "do while" loop
-                change_in_dict = False
-                for arc in self._arcs:
-                    if not state_impasse_dict[arc.terminal_state] and state_impasse_dict[arc.origin_state]:
-                        state_impasse_dict[arc.origin_state] = False
-                        change_in_dict = True
-
-                if not change_in_dict:
-                    break
-
-            impasse_states = [state for state in state_impasse_dict if state_impasse_dict[state]]
-
-            # remove arcs from arcs_by_state_dict
-            for state in impasse_states:
-                 self.arcs_by_state_dict.pop(state, None)
-
-            for origin_state in self.arcs_by_state_dict.keys():
-                for state in impasse_states:
-                    self.arcs_by_state_dict[origin_state].pop(state, None)
-
-            #remove arcs for _arcs
-            self._arcs[:] = [arc for arc in self._arcs if ((arc.origin_state not in impasse_states) and
-                                                            (arc.terminal_state not in impasse_states))]
-
-            #remove states
-            self.states[:] = [state for state in self.states if state not in impasse_states]
-            self.final_states[:] = [state for state in self.final_states if state not in impasse_states]
-
-            #logger.debug("clear_dead_states: transducer after: %s", self)
+            productive_states = self._get_connected_states(self.final_states,
+                                                           self.origin_states_by_terminal_state_dict)
+            self._keep_states(productive_states)
 
+    @staticmethod
+    def _get_connected_states(start_states, adjacency_dict):
+        connected_states = set(start_states)
+        states_queue = deque(connected_states)
+        while states_queue:
+            state = states_queue.popleft()
+            for next_state in adjacency_dict.get(state, ()):
+                if next_state not in connected_states:
+                    connected_states.add(next_state)
+                    states_queue.append(next_state)
+        return connected_states
+
+    def _keep_states(self, live_states):
+        """ removes every state that is not in live_states, and the arcs that touch it """
+        self.arcs_by_state_dict = {origin_state: {terminal_state: arcs
+                                                  for terminal_state, arcs in iteritems(arcs_by_terminal_state)
+                                                  if terminal_state in live_states}
+                                   for origin_state, arcs_by_terminal_state in iteritems(self.arcs_by_state_dict)
+                                   if origin_state in live_states}
+        self.origin_states_by_terminal_state_dict = {terminal_state: origin_states & live_states
+                                                     for terminal_state, origin_states
+                                                     in iteritems(self.origin_states_by_terminal_state_dict)
+                                                     if terminal_state in live_states}
+
+        self._arcs = [arc for arc in self._arcs if arc.origin_state in live_states and
+                                                   arc.terminal_state in live_states]
+        self.states = [state for state in self.states if state in live_states]
+        self.final_states = [state for state in self.final_states if state in live_states]
+        self.shared_fields.difference_update(("states", "final_states", "arc_lists"))
 
     def get_length_of_cost_vectors(self):
         return self.length_of_cost_vectors
@@ -155,14 +203,18 @@ class Transducer:
 
     def set_final_states(self, list_of_final_states):
         self.final_states = list_of_final_states
+        self.shared_fields.discard("final_states")
 
     def set_arcs(self, list_of_arcs):   # TODO Maybe optimization is needed - looping on arcs is costly
         self.arcs_by_state_dict = dict()
+        self.origin_states_by_terminal_state_dict = dict()
         self._arcs = list()
+        self.shared_fields.discard("arc_lists")  # the Arc objects may still be shared
         for arc in list_of_arcs:
             self.add_arc(arc)
 
     def swap_weights_on_arcs(self, i, j):
+       self._unshare("arcs")
        for arc in self._arcs:
            arc.swap_weights(i, j)
 
@@ -213,6 +265,25 @@ class Transducer:
 
         return strings
 
+    def get_output_strings(self, arc):
+        """ returns the strings an arc can output (JOKER_SEGMENT outputs any segment of the alphabet) """
+        output = arc.output
+        if isinstance(output, set):
+            return output
+        elif output == NULL_SEGMENT:
+            return ('',)
+        elif output == JOKER_SEGMENT:
+            return [segment.get_symbol() for segment in self.alphabet]
+        else:
+            return (output.get_symbol(),)
+
+    def get_range_view(self):
+        """
+        returns a lazy RangeView of the strings that get_range returns (the transducer should not be changed while
+        the view is in use)
+        """
+        return RangeView(self)
+
     def get_arcs_by_origin_state(self, origin_state):
         arcs = list()
         if origin_state in self.arcs_by_state_dict:
@@ -220,11 +291,13 @@ class Transducer:
                 arcs.extend(state_arcs)
         return arcs
 
+    def _get_arc_index(self):
+        return _ArcIndex(self)
+
     def get_arcs_by_terminal_state(self, terminal_state):
         arcs = list()
-        for state_arcs in itervalues(self.arcs_by_state_dict):
-            if terminal_state in state_arcs:
-                arcs.extend(state_arcs[terminal_state])
+        for origin_state in self.origin_states_by_terminal_state_dict.get(terminal_state, ()):
+            arcs.extend(self.arcs_by_state_dict[origin_state][terminal_state])
         return arcs
 
     def get_arcs_by_origin_and_terminal_state(self, origin_state, terminal_state):
@@ -330,7 +403,7 @@ class Transducer:
         for state1, state2 in itertools.product(transducer1.final_states, transducer2.final_states):
             transducer.final_states.append(state1 & state2)
 
-        for arc1, arc2 in itertools.product(transducer1._arcs, transducer2._arcs):
+        for arc1, arc2 in itertools.product(transducer1.get_arcs(), transducer2.get_arcs()):
             intersected_arc = Arc.intersect(arc1, arc2)
             if intersected_arc is not None:
                 transducer.add_arc(intersected_arc)
@@ -338,8 +411,150 @@ class Transducer:
         return transducer
 
 
+    @classmethod
+    def _reachable_binary_intersection(cls, transducer1, transducer2):
+        """ Intersect two transducers on the fly: product states are explored by BFS from
+        initial_state & initial_state, and arcs are only built for product states that were reached,
+        so the work is proportional to the reachable machine rather than to |Q1|*|Q2| and |A1|*|A2|.
+        The result equals _binary_intersection followed by clear_dead_states.
+
+        :param transducer1: A transducer
+        :type transducer1: Transducer
+        :param transducer2: A transducer
+        :type transducer2: Transducer
+        :rtype: Transducer
+        """
+        return cls._reachable_nary_intersection([transducer1, transducer2])
+
+    @classmethod
+    def _reachable_nary_intersection(cls, transducers, start_states_tuples=(), get_state_label=None):
+        """ Intersect any number of transducers at once by walking tuples of component states, so no
+        intermediate product machine is built. Tuples are explored by BFS from the tuple of initial states
+        (and from start_states_tuples, when other tuples should be explored as well);
+        for a reached tuple the arcs of the components are joined one component at a time, and a partial join
+        that fails to unify is dropped before the remaining components are tried.
+        The cost vector of a product arc is built in a single allocation.
+        The result equals reducing with _binary_intersection followed by clear_dead_states.
+
+        A run of single-state components whose arcs read and write segments (as Max, Dep, Ident and Faith do) is
+        first fused into one component by _fuse_single_state_transducers.
+
+        :param transducers: the transducers to intersect (cost vectors are concatenated in this order)
+        :type transducers: list of Transducer
+        :param start_states_tuples: more tuples of component states to explore from
+        :param get_state_label: returns the label of the product state of a tuple of component states (by default
+        the labels of the states, joined by "|")
+        :rtype: Transducer
+        """
+        alphabet = list(set(itertools.chain.from_iterable(transducer.alphabet for transducer in transducers)))
+        cost_vectors_length = sum(transducer.length_of_cost_vectors for transducer in transducers)
+
+        if single_state_fusion_flag and not start_states_tuples:
+            components = _fuse_single_state_runs(transducers)
+            if len(components) == 1 and len(transducers) > 1:  # the transducers are a single fused run
+                components[0].alphabet = alphabet
+                return components[0]
+            transducers = components
+
+        transducer = Transducer(alphabet, length_of_cost_vectors=cost_vectors_length)
+
+        final_states = [set(component.final_states) for component in transducers]
+        arc_indices = [component._get_arc_index() for component in transducers]
+        cost_vector_getters = [component.get_arc_cost_vector for component in transducers]
+        last_position = len(transducers) - 1
+        product_states = dict()
+        states_queue = deque()
+
+        def get_product_state(states_tuple):
+            if states_tuple not in product_states:
+                if get_state_label is None:
+                    label = "|".join(["{0}".format(state.label) for state in states_tuple])
+                else:
+                    label = get_state_label(states_tuple)
+                product_state = State(label, max(state.index for state in states_tuple))
+                product_states[states_tuple] = product_state
+                transducer.add_state(product_state)
+                if all(state in component_final_states
+                       for state, component_final_states in zip(states_tuple, final_states)):
+                    transducer.add_final_state(product_state)
+                states_queue.append(states_tuple)
+            return product_states[states_tuple]
+
+        joined_arcs = [None] * len(transducers)
+
+        def join_arcs(origin_state, states_tuple, position, unified_input, unified_output):
+            for arc in arc_indices[position].get_matching_arcs(states_tuple[position], unified_input, unified_output):
+                arc_input = Segment.intersect(unified_input, arc.input)
+                if arc_input is None:
+                    continue
+                arc_output = Segment.intersect(unified_output, arc.output)
+                if arc_output is None:
+                    continue
+                joined_arcs[position] = arc
+                if position < last_position:
+                    join_arcs(origin_state, states_tuple, position + 1, arc_input, arc_output)
+                else:
+                    cost_vector = CostVector([cost for get_arc_cost_vector, joined_arc
+                                              in zip(cost_vector_getters, joined_arcs)
+                                              for cost in get_arc_cost_vector(joined_arc).vector])
+                    terminal_state = get_product_state(tuple([joined_arc.terminal_state for joined_arc in joined_arcs]))
+                    transducer.add_arc(Arc(origin_state, arc_input, arc_output, cost_vector, terminal_state))
+
+        transducer.initial_state = get_product_state(tuple([component.initial_state for component in transducers]))
+        for states_tuple in start_states_tuples:
+            get_product_state(tuple(states_tuple))
+
+        while states_queue:
+            states_tuple = states_queue.popleft()
+            join_arcs(product_states[states_tuple], states_tuple, 0, JOKER_SEGMENT, JOKER_SEGMENT)
+
+        return transducer
+
+    @classmethod
+    def intersection_in_order(cls, transducers, order):
+        """ Intersects the transducers in order - a permutation of their positions, as get_intersection_order plans
+        it - and returns the product as their intersection in their own order: a view of it that reads the costs in
+        the order of the transducers, whose states are labeled in that order, so it equals
+        Transducer.intersection(*transducers).
+        Every run of fusable single-state transducers in the order is fused into one component.
+        """
+        components = list()
+        component_by_position = dict()
+        run = list()
+        for position in list(order) + [None]:
+            if position is not None and single_state_fusion_flag and _is_fusable(transducers[position]):
+                run.append(position)
+                continue
+            if len(run) > 1:
+                components.append(_fuse_single_state_transducers([transducers[position_] for position_ in run]))
+            else:
+                for position_ in run:
+                    component_by_position[position_] = len(components)
+                    components.append(transducers[position_])
+            run = list()
+            if position is not None:
+                component_by_position[position] = len(components)
+                components.append(transducers[position])
+
+        def get_state_label(states_tuple):
+            return "|".join(["{0}".format(states_tuple[component_by_position[position]].label
+                                          if position in component_by_position else transducer.initial_state.label)
+                             for position, transducer in enumerate(transducers)])
+
+        product = cls._reachable_nary_intersection(components, get_state_label=get_state_label)
+        offsets = dict()
+        offset = 0
+        for position in order:
+            offsets[position] = offset
+            offset += transducers[position].length_of_cost_vectors
+        return product.get_permuted_view([offsets[position] + i for position, transducer in enumerate(transducers)
+                                          for i in range(transducer.length_of_cost_vectors)])
+
     @classmethod
     def intersection(cls, *transducers):
+        if lazy_intersection_flag:
+            return Transducer._reachable_nary_intersection(transducers)
+
         intersected_transducer = functools.reduce(Transducer._binary_intersection, transducers)
         intersected_transducer.clear_dead_states()
         return intersected_transducer
@@ -377,7 +592,7 @@ class Transducer:
 
         if self.initial_state != other.initial_state:
             result = False
-        if get_set_of_strings_from_list(self._arcs) != get_set_of_strings_from_list(other._arcs):
+        if get_set_of_strings_from_list(self.get_arcs()) != get_set_of_strings_from_list(other.get_arcs()):
             result = False
         if get_set_of_strings_from_list(self.states) != get_set_of_strings_from_list(other.states):
             result = False
@@ -387,6 +602,388 @@ class Transducer:
         return result
 
 
+def _fuse_single_state_runs(transducers):
+    """ returns the transducers with every run of two or more fusable single-state transducers fused into one """
+    components = list()
+    run = list()
+    for component in list(transducers) + [None]:
+        if component is not None and _is_fusable(component):
+            run.append(component)
+            continue
+        if len(run) > 1:
+            components.append(_fuse_single_state_transducers(run))
+        else:
+            components.extend(run)
+        run = list()
+        if component is not None:
+            components.append(component)
+    return components
+
+
+def _is_fusable(transducer):
+    """ a transducer is fusable if it has a single (initial and final) state and its arcs read and write segments,
+    not JOKER_SEGMENT or sets """
+    if len(transducer.states) != 1 or transducer.final_states != [transducer.initial_state]:
+        return False
+    return all(_get_label_key(arc.input) not in _WILDCARD_KEYS and _get_label_key(arc.output) not in _WILDCARD_KEYS
+               for arc in transducer._arcs)
+
+
+def get_intersection_order(transducers):
+    """ Plans the order to intersect the transducers in, as a list of their positions: the transducers that are not
+    fusable first, by their estimated fan-out - the number of arcs of a state that match the labels bound by the
+    components before it, where an arc of JOKER_SEGMENT or a set matches any label and an arc of a segment matches
+    one label of the alphabet - and then the fusable single-state transducers, which are fused into one keyed join
+    however they are ranked. So the join starts from the few (set) arcs of the phonotactic states, and the fused
+    component is only looked up by the labels they bound. Ties keep the order of the transducers.
+    """
+    fusable_positions = [position for position, transducer in enumerate(transducers) if _is_fusable(transducer)]
+    other_positions = [position for position, transducer in enumerate(transducers) if not _is_fusable(transducer)]
+    other_positions.sort(key=lambda position: _get_bound_fan_out(transducers[position]))
+    return other_positions + fusable_positions
+
+
+def _get_bound_fan_out(transducer):
+    segment_match_rate = 1.0 / (len(transducer.alphabet) + 1)  # NULL_SEGMENT is one of the labels
+
+    def get_match_rate(label):
+        return 1.0 if _get_label_key(label) in _WILDCARD_KEYS else segment_match_rate
+
+    return sum(get_match_rate(arc.input) * get_match_rate(arc.output)
+               for arc in transducer._arcs) / max(len(transducer.states), 1)
+
+
+def _fuse_single_state_transducers(transducers):
+    """ Intersects single-state transducers as one keyed join: the arcs of every transducer but the first are
+    hashed by their (input, output) symbols, and every arc of the first is extended by the arcs under its key.
+    So the fused transducer is made in time linear in the number of arcs, and no product states are made.
+    Its state, arcs and cost vectors are those that _reachable_nary_intersection makes for the run, in the same
+    order (_ArcIndex matches the arcs of a segment in the order they are stored in, as the hash does).
+    """
+    states = [component.initial_state for component in transducers]
+    state = State("|".join(["{0}".format(state_.label) for state_ in states]), max(state_.index for state_ in states))
+    fused_transducer = Transducer(list(set(itertools.chain.from_iterable(component.alphabet
+                                                                         for component in transducers))),
+                                  length_of_cost_vectors=sum(component.length_of_cost_vectors
+                                                             for component in transducers))
+    fused_transducer.set_as_single_state(state)
+
+    components_arcs = [component._get_arc_index().get_arcs_by_origin_state(component_state)
+                       for component, component_state in zip(transducers, states)]
+    arcs_by_labels = list()
+    for arcs in components_arcs[1:]:
+        component_arcs_by_labels = defaultdict(list)
+        for arc in arcs:
+            component_arcs_by_labels[(arc.input.get_symbol(), arc.output.get_symbol())].append(arc)
+        arcs_by_labels.append(component_arcs_by_labels)
+
+    cost_vector_getters = [component.get_arc_cost_vector for component in transducers]
+    for first_arc in components_arcs[0]:
+        labels = (first_arc.input.get_symbol(), first_arc.output.get_symbol())
+        joins = [(first_arc.input, first_arc.output, (first_arc,))]
+        for component_arcs_by_labels in arcs_by_labels:
+            joins = [(Segment.intersect(arc_input, arc.input), Segment.intersect(arc_output, arc.output),
+                      joined_arcs + (arc,))
+                     for arc_input, arc_output, joined_arcs in joins
+                     for arc in component_arcs_by_labels.get(labels, ())]
+        for arc_input, arc_output, joined_arcs in joins:
+            cost_vector = CostVector([cost for get_arc_cost_vector, arc in zip(cost_vector_getters, joined_arcs)
+                                      for cost in get_arc_cost_vector(arc).vector])
+            fused_transducer.add_arc(Arc(state, arc_input, arc_output, cost_vector, state))
+    return fused_transducer
+
+
+class PermutedTransducer(Transducer):
+    """ A view of a transducer that reads its costs through a permutation, as if the constraints were ranked in
+    another order. The view shares the states and arcs of the transducer (copy-on-write, as clone does), and an
+    intersection reads the permuted costs through get_arc_cost_vector, so re-ranking a transducer copies nothing.
+    Swapping weights on the view only swaps the permutation. Reading the arcs through the other Transducer
+    accessors (get_arcs, clone, comparing...), or changing them, makes the permuted arcs first (and the view is
+    then a plain transducer): a re-ranking costs O(1) only while the view is read by intersections, as the lazy
+    grammar transducer reads it.
+    """
+    __slots__ = ["permutation", "permuted_cost_vectors"]
+
+    def __init__(self, transducer, permutation):
+        Transducer.__init__(self, transducer.alphabet, transducer.name, transducer.length_of_cost_vectors)
+        if isinstance(transducer, PermutedTransducer) and transducer.permutation is not None:
+            permutation = [transducer.permutation[i] for i in permutation]  # a view of the underlying arcs
+        self._share_storage_of(transducer)
+        self.permutation = list(permutation)
+        self.permuted_cost_vectors = dict()
+
+    def get_arc_cost_vector(self, arc):
+        if self.permutation is None:
+            return arc.cost_vector
+        cost_vector = arc.cost_vector
+        if cost_vector not in self.permuted_cost_vectors:
+            self.permuted_cost_vectors[cost_vector] = CostVector([cost_vector.vector[i] for i in self.permutation])
+        return self.permuted_cost_vectors[cost_vector]
+
+    def swap_weights_on_arcs(self, i, j):
+        if self.permutation is None:
+            return Transducer.swap_weights_on_arcs(self, i, j)
+        self.permutation[i], self.permutation[j] = self.permutation[j], self.permutation[i]
+        self.permuted_cost_vectors = dict()
+
+    def _get_arc_index(self):
+        # the stored arcs, whose costs the intersection reads through get_arc_cost_vector
+        return _ArcIndex(self, functools.partial(Transducer.get_arcs_by_origin_state, self))
+
+    def _make_permuted_arcs(self):
+        if self.permutation is not None:
+            arcs = [Arc(arc.origin_state, arc.input, arc.output, self.get_arc_cost_vector(arc), arc.terminal_state)
+                    for arc in self._arcs]
+            self.permutation = None
+            self.permuted_cost_vectors = None
+            Transducer.set_arcs(self, arcs)
+            self.shared_fields.discard("arcs")
+
+    def get_arcs(self):
+        self._make_permuted_arcs()
+        return Transducer.get_arcs(self)
+
+    def get_arcs_by_origin_state(self, origin_state):
+        self._make_permuted_arcs()
+        return Transducer.get_arcs_by_origin_state(self, origin_state)
+
+    def get_arcs_by_terminal_state(self, terminal_state):
+        self._make_permuted_arcs()
+        return Transducer.get_arcs_by_terminal_state(self, terminal_state)
+
+    def get_arcs_by_origin_and_terminal_state(self, origin_state, terminal_state):
+        self._make_permuted_arcs()
+        return Transducer.get_arcs_by_origin_and_terminal_state(self, origin_state, terminal_state)
+
+    def add_arc(self, arc):
+        self._make_permuted_arcs()
+        Transducer.add_arc(self, arc)
+
+    def remove_arc(self, arc):
+        self._make_permuted_arcs()
+        Transducer.remove_arc(self, arc)
+
+    def set_arcs(self, list_of_arcs):
+        self.permutation = None  # the new arcs are in the order of the view
+        self.permuted_cost_vectors = None
+        Transducer.set_arcs(self, list_of_arcs)
+
+    def clear_dead_states(self, with_impasse_states=False):
+        self._make_permuted_arcs()
+        Transducer.clear_dead_states(self, with_impasse_states)
+
+    def clone(self):
+        self._make_permuted_arcs()
+        return Transducer.clone(self)
+
+    def dot_representation(self):
+        self._make_permuted_arcs()
+        return Transducer.dot_representation(self)
+
+    def __str__(self):
+        self._make_permuted_arcs()
+        return Transducer.__str__(self)
+
+
+class _ArcIndex:
+    """ Buckets the arcs of every origin state by input symbol and by output symbol, so that an intersection can
+    hash-join the arcs that can unify instead of trying Arc.intersect on the full cross product.
+    JOKER_SEGMENT and set labels (which can unify with many symbols) are kept in buckets of their own.
+    States are indexed lazily, the first time they are queried.
+    """
+    __slots__ = ["get_arcs_by_origin_state", "buckets_by_state"]
+
+    def __init__(self, transducer, get_arcs_by_origin_state=None):
+        self.get_arcs_by_origin_state = get_arcs_by_origin_state or transducer.get_arcs_by_origin_state
+        self.buckets_by_state = dict()
+
+    def _get_buckets(self, state):
+        if state not in self.buckets_by_state:
+            arcs = self.get_arcs_by_origin_state(state)
+            arcs_by_input = defaultdict(list)
+            arcs_by_output = defaultdict(list)
+            for arc in arcs:
+                arcs_by_input[_get_label_key(arc.input)].append(arc)
+                arcs_by_output[_get_label_key(arc.output)].append(arc)
+            self.buckets_by_state[state] = (arcs, arcs_by_input, arcs_by_output)
+        return self.buckets_by_state[state]
+
+    def get_matching_arcs(self, state, input, output):
+        """ returns the arcs leaving state whose input and output may unify with the given labels
+        (a superset of the arcs for which the unification succeeds)
+        """
+        arcs, arcs_by_input, arcs_by_output = self._get_buckets(state)
+        input_key = _get_label_key(input)
+        if input_key not in _WILDCARD_KEYS:
+            return itertools.chain(arcs_by_input.get(input_key, ()), arcs_by_input.get(_JOKER_KEY, ()),
+                                   arcs_by_input.get(_SET_KEY, ()))
+        output_key = _get_label_key(output)
+        if output_key not in _WILDCARD_KEYS:
+            return itertools.chain(arcs_by_output.get(output_key, ()), arcs_by_output.get(_JOKER_KEY, ()),
+                                   arcs_by_output.get(_SET_KEY, ()))
+        return arcs
+
+
+class RangeView:
+    """ A lazy view of the range of a transducer, shaped as a trie over the output characters.
+    A trie node is the set of (state, pending output) pairs that the output prefix leading to it can end in; nodes
+    are built on demand, so iteration, membership tests and counting never build the whole set of strings that
+    get_range builds. The number of strings is counted by dynamic programming over the nodes.
+    A range with a cycle that emits characters is infinite and raises a TransducerError when counted or iterated.
+    """
+    __slots__ = ["transducer", "final_states", "root", "children_by_node", "count_by_node"]
+
+    def __init__(self, transducer):
+        self.transducer = transducer
+        self.final_states = set(transducer.final_states)
+        self.children_by_node = dict()
+        self.count_by_node = dict()
+        self.root = self._get_closure([(transducer.initial_state, '')])
+
+    def _get_closure(self, pairs):
+        """ adds the pairs reachable from a state with no pending output, over the arcs leaving it """
+        closure = set(pairs)
+        stack = list(closure)
+        while stack:
+            state, pending_output = stack.pop()
+            if pending_output:
+                continue
+            for arc in self.transducer.get_arcs_by_origin_state(state):
+                for string in self.transducer.get_output_strings(arc):
+                    pair = (arc.terminal_state, string)
+                    if pair not in closure:
+                        closure.add(pair)
+                        stack.append(pair)
+        return frozenset(closure)
+
+    def _get_children(self, node):
+        """ returns a dict: next output character -> child node """
+        if node not in self.children_by_node:
+            pairs_by_character = defaultdict(list)
+            for state, pending_output in node:
+                if pending_output:
+                    pairs_by_character[pending_output[0]].append((state, pending_output[1:]))
+            self.children_by_node[node] = {character: self._get_closure(pairs)
+                                           for character, pairs in iteritems(pairs_by_character)}
+        return self.children_by_node[node]
+
+    def _is_accepting(self, node):
+        return any(not pending_output and state in self.final_states for state, pending_output in node)
+
+    def _count(self, node, nodes_in_progress):
+        if node not in self.count_by_node:
+            if node in nodes_in_progress:
+                raise TransducerError("The range of the transducer is infinite")
+            nodes_in_progress.add(node)
+            count = int(self._is_accepting(node))
+            for child in itervalues(self._get_children(node)):
+                count += self._count(child, nodes_in_progress)
+            nodes_in_progress.remove(node)
+            self.count_by_node[node] = count
+        return self.count_by_node[node]
+
+    def __len__(self):
+        return self._count(self.root, set())
+
+    def __contains__(self, string):
+        node = self.root
+        for character in string:
+            node = self._get_children(node).get(character)
+            if node is None:
+                return False
+        return self._is_accepting(node)
+
+    def select(self, strings):
+        """ returns the strings (of a given iterable) that are in the range; walks that share a prefix are done once """
+        node_by_prefix = {'': self.root}
+
+        def get_node(prefix):
+            if prefix not in node_by_prefix:
+                parent_node = get_node(prefix[:-1])
+                node_by_prefix[prefix] = None if parent_node is None else \
+                    self._get_children(parent_node).get(prefix[-1])
+            return node_by_prefix[prefix]
+
+        selected_strings = list()
+        for string in strings:
+            node = get_node(string)
+            if node is not None and self._is_accepting(node):
+                selected_strings.append(string)
+        return selected_strings
+
+    def select_in(self, strings_trie):
+        """ returns the strings of a trie (made by make_strings_trie) that are in the range. A range of up to
+        listed_range_size strings is listed and its strings looked up in the trie; a larger one is walked alongside
+        the trie, down the prefixes that both share and that lead to strings of the range.
+        Fails on an infinite range, as len does.
+        """
+        if len(self) <= listed_range_size:
+            return [string for string in self if _is_in_strings_trie(strings_trie, string)]
+        selected_strings = list()
+        stack = [(strings_trie, self.root)]
+        while stack:
+            trie_node, node = stack.pop()
+            for character, trie_child in iteritems(trie_node):
+                if character is None:
+                    if self._is_accepting(node):
+                        selected_strings.append(trie_child)
+                    continue
+                child = self._get_children(node).get(character)
+                if child is not None and self.count_by_node[child]:
+                    stack.append((trie_child, child))
+        return selected_strings
+
+    def __iter__(self):
+        if not len(self):  # also fails early on an infinite range
+            return
+        stack = [('', self.root)]
+        while stack:
+            prefix, node = stack.pop()
+            if self._is_accepting(node):
+                yield prefix
+            for character, child in iteritems(self._get_children(node)):
+                if self.count_by_node[child]:
+                    stack.append((prefix + character, child))
+
+    def __str__(self):
+        return "RangeView of {0} strings".format(len(self))
+
+
+def make_strings_trie(strings):
+    """ returns a trie of strings for RangeView.select_in: a dict from the next character to the sub trie, in which
+    the key None maps to the string that ends there """
+    strings_trie = dict()
+    for string in strings:
+        node = strings_trie
+        for character in string:
+            node = node.setdefault(character, dict())
+        node[None] = string
+    return strings_trie
+
+
+def _is_in_strings_trie(strings_trie, string):
+    node = strings_trie
+    for character in string:
+        node = node.get(character)
+        if node is None:
+            return False
+    return None in node
+
+
+_SHAREABLE_FIELDS = ("states", "final_states", "arc_lists", "arcs")
+
+_JOKER_KEY = JOKER_SEGMENT.get_symbol()
+_SET_KEY = None
+_WILDCARD_KEYS = (_JOKER_KEY, _SET_KEY)
+
+
+def _get_label_key(label):
+    """ a Segment is keyed by its symbol; all set labels share one bucket """
+    if isinstance(label, set):
+        return _SET_KEY
+    return label.get_symbol()
+
+
 class State:
     __slots__ = ["label", "index", "hash"]
 
@@ -474,10 +1071,25 @@ class CostVectorOperationError(Exception):
 
 
 class CostVector:
+    _packed = None  # the PackedCostVector of the vector, made on first use
+
     def __init__(self, vector):
         self.vector = vector
         self.hash = hash(str(self.vector))
 
+    def get_packed(self):
+        if self._packed is None:
+            if self == _INF_VECTOR:
+                self._packed = PackedCostVector.INF
+            else:
+                self._packed = PackedCostVector.from_counts(self.vector)
+        return self._packed
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_packed", None)  # made again on first use
+        return state
+
     def _verify_equal_length(self, other):
         if len(self.vector) != len(other.vector):
                 raise CostVectorOperationError
@@ -485,6 +1097,7 @@ class CostVector:
     def swap_weights(self, i, j):
         self.vector[i], self.vector[j] = self.vector[j], self.vector[i]
         self.hash = hash(str(self.vector))
+        self._packed = None
 
     def __add__(self, other):
         """Vector pointwise addition - must have the same length"""
@@ -519,9 +1132,9 @@ class CostVector:
         return not __gt__ and not self == other
 
     def __gt__(self, other):
-        if self == CostVector.get_inf_vector():
+        if self is _INF_VECTOR or self == _INF_VECTOR:
             return False
-        if other == CostVector.get_inf_vector():
+        if other is _INF_VECTOR or other == _INF_VECTOR:
             return True
         else:
             self._verify_equal_length(other)
@@ -535,7 +1148,7 @@ class CostVector:
                     return False
     @staticmethod
     def get_inf_vector():
-        return CostVector(float("inf"))  #TODO create static variable
+        return _INF_VECTOR
 
     @staticmethod
     def get_empty_vector():
@@ -543,4 +1156,114 @@ class CostVector:
 
     @staticmethod
     def get_vector(size, value):
-        return CostVector([value] * size)
\ No newline at end of file
+        return CostVector([value] * size)
+
+
+_INF_VECTOR = CostVector(float("inf"))
+
+
+class PackedCostVector:
+    """ An immutable cost vector whose violation counts are packed into a single int, FIELD_BITS bits per
+    constraint with the first (highest ranked) constraint in the most significant field. Lexicographic comparison
+    and pointwise addition are then native int operations, and the natural order is the harmony order:
+    a < b iff a is more harmonic than b.
+    The top bit of every field is a guard bit - a count that does not fit below it (or a negative count) makes the
+    vector fall back to a tuple of counts, which compares and adds the same way, only slower.
+    INF is the shared infinite vector - it is less harmonic than any other vector and absorbs addition.
+    """
+    __slots__ = ["key", "length"]
+
+    FIELD_BITS = 16
+    MAX_COUNT = (1 << (FIELD_BITS - 1)) - 1
+    INF = None
+    _guard_masks = dict()
+
+    def __init__(self, key, length):
+        self.key = key  # an int, or a tuple of counts
+        self.length = length
+
+    @classmethod
+    def from_counts(cls, counts):
+        key = 0
+        for count in counts:
+            if not 0 <= count <= cls.MAX_COUNT:
+                return cls(tuple(counts), len(counts))
+            key = (key << cls.FIELD_BITS) | count
+        return cls(key, len(counts))
+
+    @classmethod
+    def get_zero(cls, length):
+        return cls(0, length)
+
+    @classmethod
+    def _get_guard_mask(cls, length):
+        if length not in cls._guard_masks:
+            guard_bit = 1 << (cls.FIELD_BITS - 1)
+            cls._guard_masks[length] = sum(guard_bit << (cls.FIELD_BITS * i) for i in range(length))
+        return cls._guard_masks[length]
+
+    def get_counts(self):
+        if self.key.__class__ is tuple:
+            return self.key
+        field_mask = (1 << self.FIELD_BITS) - 1
+        return tuple((self.key >> (self.FIELD_BITS * i)) & field_mask for i in reversed(range(self.length)))
+
+    def unpack(self):
+        if self is PackedCostVector.INF:
+            return _INF_VECTOR
+        return CostVector(list(self.get_counts()))
+
+    def __add__(self, other):
+        if self is PackedCostVector.INF or other is PackedCostVector.INF:
+            return PackedCostVector.INF
+        if self.length != other.length:
+            raise CostVectorOperationError
+        if self.key.__class__ is int and other.key.__class__ is int:
+            key = self.key + other.key
+            if not key & self._get_guard_mask(self.length):
+                return PackedCostVector(key, self.length)
+        return PackedCostVector(tuple(a + b for a, b in zip(self.get_counts(), other.get_counts())), self.length)
+
+    def _get_keys(self, other):
+        if self.key.__class__ is other.key.__class__:
+            return self.key, other.key
+        return self.get_counts(), other.get_counts()
+
+    def __lt__(self, other):
+        if self is PackedCostVector.INF:
+            return False
+        if other is PackedCostVector.INF:
+            return True
+        key, other_key = self._get_keys(other)
+        return key < other_key
+
+    def __le__(self, other):
+        return not other < self
+
+    def __gt__(self, other):
+        return other < self
+
+    def __ge__(self, other):
+        return not self < other
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if self is PackedCostVector.INF or other is PackedCostVector.INF:
+            return False
+        key, other_key = self._get_keys(other)
+        return key == other_key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.get_counts()) if self is not PackedCostVector.INF else hash(float("inf"))
+
+    def __str__(self):
+        if self is PackedCostVector.INF:
+            return "inf"
+        return str(list(self.get_counts()))
+
+
+PackedCostVector.INF = PackedCostVector(float("inf"), 0)
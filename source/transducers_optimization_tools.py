@@ -3,56 +3,57 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import logging
 import itertools
+import multiprocessing
 from functools import reduce
-import pickle
+from heapq import heappush, heappop
 
-from transducer import Transducer, CostVector, Arc
+from transducer import Transducer, CostVector, PackedCostVector, Arc, State, JOKER_SEGMENT
+from grammar.feature_table import Segment
 from grammar.lexicon import Word
-import random
+from six import itervalues, iteritems
 
 
 logger = logging.getLogger(__name__)
 
+single_source_optimal_paths_flag = True
+
+parallel_optimal_paths_flag = False  # compute the arcs of the grammar transducers in a pool of processes
+number_of_optimal_paths_processes = None  # None for one process per CPU
+
+_optimal_paths_pool = None  # started when it is first needed, and kept for the later grammars
+
 class TransducerOptimizationError(Exception):
     pass
 
 
-def get_cheapest_state(list_of_states, cost_by_state_dict):
+class FreeEpenthesisError(TransducerOptimizationError):
+    """ The optimal paths that read a segment go around a cycle that costs nothing - an epenthesis that no
+    constraint of the ranking penalizes (e.g. Dep[-labial] >> Ident[-syll] >> Max[-cons, -syll], which inserts
+    +labial segments for free) - so the segment has infinitely many optimal outputs.
+    """
+    pass
 
-    most_harmonic_state = random.choice(list_of_states)
-    try:   #TODO for debug prints
-        most_harmonic_cost_vector = cost_by_state_dict[most_harmonic_state]
-    except KeyError as ex:
-        #print(cost_by_state_dict)
-        raise ex
-    for state in list_of_states:
-        if cost_by_state_dict[state] > most_harmonic_cost_vector:
-            most_harmonic_cost_vector = cost_by_state_dict[state]
-            most_harmonic_state = state
-    return most_harmonic_state
 
 def remove_suboptimal_paths(transducer):
-    active_states = set(transducer.states)
-    costs = {state: CostVector.get_inf_vector() for state in active_states}
-    costs[transducer.initial_state] = CostVector.get_vector(transducer.get_length_of_cost_vectors(), 0)
-
-    while active_states:
-        cheapest_state = get_cheapest_state(list(active_states), costs)
-        active_states.remove(cheapest_state)
-        for state in active_states:
-            for arc in transducer.get_arcs_by_origin_and_terminal_state(cheapest_state, state):
-                costs[state] = max(costs[state], costs[cheapest_state] + arc.cost_vector)
-    try:    #TODO for debug prints
-        most_harmonic_final = get_cheapest_state(transducer.get_final_states(), costs)
-    except KeyError as ex:
-        #print(transducer.get_final_states())
-        #print(transducer.dot_representation())
-        raise ex
+    """ Keeps only the arcs on optimal paths from the initial state, and a single most harmonic final state
+    (the first of the co-optimal final states in final_states order). All the co-optimal arcs into a state are kept.
+
+    :type transducer: Transducer
+    :rtype: Transducer
+    """
+    costs = _get_optimal_costs(transducer, transducer.initial_state)
+
+    final_states = transducer.get_final_states()
+    most_harmonic_final = final_states[0]
+    for state in final_states:
+        if costs.get(state, PackedCostVector.INF) < costs.get(most_harmonic_final, PackedCostVector.INF):
+            most_harmonic_final = state
     transducer.set_final_state(most_harmonic_final)
 
     new_arcs = []
     for arc in transducer.get_arcs():
-        if costs[arc.origin_state] + arc.cost_vector == costs[arc.terminal_state]:
+        if arc.origin_state in costs and \
+                costs[arc.origin_state] + arc.cost_vector.get_packed() == costs[arc.terminal_state]:
             new_arcs.append(arc)
     transducer.set_arcs(new_arcs)
 
@@ -60,6 +61,60 @@ def remove_suboptimal_paths(transducer):
     return transducer
 
 
+def minimize_transducer(transducer):
+    """ Merges states that have identical future behaviour - the same finality and, for every input, output and
+    cost vector, arcs into equivalent states. Costs are treated as part of the arc label, so the merged machine
+    assigns every path exactly the cost vector it had before, under any ranking of the cost vector columns.
+    Equivalent states are found by partition refinement (the coarsest bisimulation).
+
+    :type transducer: Transducer
+    :rtype: Transducer
+    """
+    states = transducer.get_states()
+    final_states = set(transducer.get_final_states())
+    block_by_state = {state: int(state in final_states) for state in states}
+    number_of_blocks = len(set(block_by_state.values()))
+
+    while True:
+        signatures = dict()
+        new_block_by_state = dict()
+        for state in states:
+            signature = (block_by_state[state],
+                         frozenset((_get_arc_label_signature(arc.input), _get_arc_label_signature(arc.output),
+                                    str(arc.cost_vector), block_by_state[arc.terminal_state])
+                                   for arc in transducer.get_arcs_by_origin_state(state)))
+            new_block_by_state[state] = signatures.setdefault(signature, len(signatures))
+        block_by_state = new_block_by_state
+        if len(signatures) == number_of_blocks:
+            break
+        number_of_blocks = len(signatures)
+
+    if number_of_blocks == len(states):
+        return transducer
+
+    representative_by_block = dict()
+    for state in states:
+        representative_by_block.setdefault(block_by_state[state], state)
+    representatives = list(itervalues(representative_by_block))
+
+    def get_representative(state):
+        return representative_by_block[block_by_state[state]]
+
+    new_arcs = [Arc(state, arc.input, arc.output, arc.cost_vector, get_representative(arc.terminal_state))
+                for state in representatives for arc in transducer.get_arcs_by_origin_state(state)]
+    transducer.states = representatives
+    transducer.initial_state = get_representative(transducer.initial_state)
+    transducer.set_final_states([state for state in representatives if state in final_states])
+    transducer.set_arcs(new_arcs)
+    return transducer
+
+
+def _get_arc_label_signature(label):
+    if isinstance(label, set):
+        return frozenset(label)
+    return label.get_symbol()
+
+
 def _get_path_cost(transducer):
     #logger.debug("_get_path_cost: transducer input: %s", transducer)
     current_state = transducer.get_a_final_state()
@@ -80,45 +135,401 @@ def _get_path_cost(transducer):
 
 
 def make_optimal_paths(transducer_input, feature_table):
-    transducer = pickle.loads(pickle.dumps(transducer_input, -1))
+    """ Makes the grammar transducer of a constraint-set transducer: an arc for every segment and pair of states,
+    with the outputs and the cost of the optimal paths that read the segment between them.
+    Raises FreeEpenthesisError when a segment has infinitely many optimal outputs (see _get_optimal_arcs_from_state).
+    """
+    transducer = transducer_input.clone()
     alphabet = transducer.get_alphabet()
     new_arcs = list()
-    for segment in alphabet:
-        word = Word(segment.get_symbol(), feature_table)
-        word_transducer = word.get_transducer()
-        # (word_transducer.dot_representation())
-        intersected_machine = Transducer.intersection(word_transducer, transducer)
+    if parallel_optimal_paths_flag and single_source_optimal_paths_flag:
+        arcs_descriptions_by_symbol = _get_optimal_arcs_descriptions_in_processes(transducer, alphabet, feature_table)
         states = transducer.get_states()
-        for state1, state2 in itertools.product(states, states):
-            initial_state = word_transducer.initial_state & state1
-            final_state = word_transducer.get_a_final_state() & state2
-            temp_transducer = pickle.loads(pickle.dumps(intersected_machine, -1))
-            temp_transducer.initial_state = initial_state
-            temp_transducer.set_final_state(final_state)
-            temp_transducer.clear_dead_states()
-            if final_state in temp_transducer.get_final_states():  # otherwise no path.
-                try:
-                    temp_transducer = remove_suboptimal_paths(temp_transducer)
-                    #write_to_dot(temp_transducer, "temp_transducer")
-                    range = temp_transducer.get_range()
-                    arc = Arc(state1, segment, range, _get_path_cost(temp_transducer), state2)
-                    new_arcs.append(arc)
-                except KeyError:
-                    pass
-                #print("****")
-                #print(temp_transducer.dot_representation())
+        for segment in alphabet:
+            for state, arcs_descriptions in zip(states, arcs_descriptions_by_symbol[segment.get_symbol()]):
+                if isinstance(arcs_descriptions, FreeEpenthesisError):
+                    raise arcs_descriptions
+                new_arcs.extend(_make_described_arcs(state, segment, arcs_descriptions, states))
+    else:
+        for segment in alphabet:
+            new_arcs.extend(_get_optimal_arcs(transducer, segment, feature_table))
 
     transducer.set_arcs(new_arcs)
     return transducer
 
 
+def _intersect_with_segment(transducer, segment_symbol, feature_table):
+    """ returns the transducer of the word of the segment and its intersection with transducer - explored from all
+    the states, as every state is an origin of new arcs (not only the states that the word's NULL:JOKER loops reach
+    from the initial state over epenthesis arcs) """
+    word_transducer = Word(segment_symbol, feature_table).get_transducer()
+    intersected_machine = Transducer._reachable_nary_intersection(
+        [word_transducer, transducer], [(word_transducer.initial_state, state) for state in transducer.get_states()])
+    return word_transducer, intersected_machine
+
+
+def _get_optimal_arcs(transducer, segment, feature_table):
+    """ returns the arcs of make_optimal_paths that read segment """
+    word_transducer, intersected_machine = _intersect_with_segment(transducer, segment.get_symbol(), feature_table)
+    states = transducer.get_states()
+    new_arcs = list()
+    if single_source_optimal_paths_flag:
+        for state1 in states:
+            new_arcs.extend(_get_optimal_arcs_from_state(intersected_machine, word_transducer, segment,
+                                                         state1, states))
+        return new_arcs
+
+    for state1, state2 in itertools.product(states, states):
+        initial_state = word_transducer.initial_state & state1
+        final_state = word_transducer.get_a_final_state() & state2
+        temp_transducer = intersected_machine.clone()
+        temp_transducer.initial_state = initial_state
+        temp_transducer.set_final_state(final_state)
+        temp_transducer.clear_dead_states()
+        if final_state in temp_transducer.get_final_states():  # otherwise no path.
+            try:
+                temp_transducer = remove_suboptimal_paths(temp_transducer)
+                #write_to_dot(temp_transducer, "temp_transducer")
+                range = temp_transducer.get_range()
+                arc = Arc(state1, segment, range, _get_path_cost(temp_transducer), state2)
+                new_arcs.append(arc)
+            except KeyError:
+                pass
+            #print("****")
+            #print(temp_transducer.dot_representation())
+    return new_arcs
+
+
+def _get_optimal_paths_pool():
+    """ returns the process pool, started the first time it is asked for. Its workers are forked, so the modules
+    and the configurations they need are already loaded in them (multiprocessing.Pool forks on POSIX in Python 2) """
+    global _optimal_paths_pool
+    if _optimal_paths_pool is None:
+        context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+        _optimal_paths_pool = context.Pool(number_of_optimal_paths_processes)
+    return _optimal_paths_pool
+
+
+def _get_optimal_arcs_descriptions_in_processes(transducer, segments, feature_table):
+    """ Fans the segments out over the process pool, in one task per process that carries the transducer and the
+    feature table. Returns the _get_optimal_arcs_descriptions of every segment symbol.
+    """
+    number_of_tasks = min(len(segments), number_of_optimal_paths_processes or multiprocessing.cpu_count())
+    symbols = [segment.get_symbol() for segment in segments]
+    tasks = [(transducer, feature_table, symbols[i::number_of_tasks]) for i in range(number_of_tasks)]
+    arcs_descriptions_by_symbol = dict()
+    for task_arcs_descriptions in _get_optimal_paths_pool().map(_get_optimal_arcs_descriptions, tasks):
+        arcs_descriptions_by_symbol.update(task_arcs_descriptions)
+    return arcs_descriptions_by_symbol
+
+
+def _get_optimal_arcs_descriptions(task):
+    """ runs in the pool: for every segment symbol of the task, a list with an item for each state of the
+    transducer - the (terminal state index, outputs, cost vector) of the arcs that read the segment from the state,
+    or the FreeEpenthesisError that computing them raises """
+    transducer, feature_table, symbols = task
+    states = transducer.get_states()
+    index_by_state = {state: index for index, state in enumerate(states)}
+    segment_by_symbol = {segment.get_symbol(): segment for segment in transducer.get_alphabet()}
+    arcs_descriptions_by_symbol = dict()
+    for symbol in symbols:
+        word_transducer, intersected_machine = _intersect_with_segment(transducer, symbol, feature_table)
+        arcs_descriptions_by_state = list()
+        for state in states:
+            try:
+                arcs = _get_optimal_arcs_from_state(intersected_machine, word_transducer, segment_by_symbol[symbol],
+                                                    state, states)
+            except FreeEpenthesisError as ex:
+                arcs_descriptions_by_state.append(ex)
+                continue
+            arcs_descriptions_by_state.append([(index_by_state[arc.terminal_state], arc.output, arc.cost_vector.vector)
+                                               for arc in arcs])
+        arcs_descriptions_by_symbol[symbol] = arcs_descriptions_by_state
+    return arcs_descriptions_by_symbol
+
+
+def _make_described_arcs(state, segment, arcs_descriptions, states):
+    """ rebuilds the arcs of _get_optimal_arcs_descriptions on the states and the segment of this process """
+    return [Arc(state, segment, outputs, CostVector(cost_vector), states[terminal_state_index])
+            for terminal_state_index, outputs, cost_vector in arcs_descriptions]
+
+
+class LazyGrammarTransducer(Transducer):
+    """ The transducer that make_optimal_paths makes, with its arcs computed on demand: the arcs that read a segment
+    from a state are computed (and kept) the first time an intersection asks for them, so a grammar costs what the
+    words it is applied to need, rather than the full alphabet x states x states table.
+    The intersection of the word with the constraint-set transducer is made once per segment that is asked for.
+    Reading the arcs through the Transducer accessors computes all of them first.
+    Computing the arcs of a segment raises FreeEpenthesisError, as make_optimal_paths does, when the ranking lets
+    the segment have infinitely many optimal outputs.
+
+    These intersections (the candidate lattices of the segments) do not depend on the ranking: when
+    candidate_lattices is given it keeps them with the order of the constraints they were made with, so a
+    transducer of another ranking of the constraints ranks them by reading their costs through a permutation.
+    """
+    __slots__ = ["constraint_set_transducer", "feature_table", "segment_by_symbol", "intersected_machines",
+                 "arcs_by_state_and_symbol", "all_arcs_computed", "constraint_names", "arc_cost_getters"]
+
+    def __init__(self, constraint_set_transducer, feature_table, constraint_names=None, candidate_lattices=None):
+        Transducer.__init__(self, constraint_set_transducer.get_alphabet(),
+                            length_of_cost_vectors=constraint_set_transducer.get_length_of_cost_vectors())
+        self.states = list(constraint_set_transducer.get_states())
+        self.initial_state = constraint_set_transducer.initial_state
+        self.final_states = list(constraint_set_transducer.get_final_states())
+        self.constraint_set_transducer = constraint_set_transducer
+        self.feature_table = feature_table
+        self.segment_by_symbol = {segment.get_symbol(): segment for segment in self.alphabet}
+        self.intersected_machines = dict() if candidate_lattices is None else candidate_lattices
+        self.arcs_by_state_and_symbol = dict()
+        self.all_arcs_computed = False
+        self.constraint_names = constraint_names
+        self.arc_cost_getters = dict()
+
+    def get_arcs_reading(self, state, symbol):
+        """ returns the arcs that read the segment symbol from state """
+        key = (state, symbol)
+        if key not in self.arcs_by_state_and_symbol:
+            segment = self.segment_by_symbol[symbol]
+            if symbol not in self.intersected_machines:
+                word_transducer, intersected_machine = _intersect_with_segment(self.constraint_set_transducer,
+                                                                               symbol, self.feature_table)
+                self.intersected_machines[symbol] = (self.constraint_names, word_transducer, intersected_machine)
+            lattice_constraint_names, word_transducer, intersected_machine = self.intersected_machines[symbol]
+            arcs = _get_optimal_arcs_from_state(intersected_machine, word_transducer, segment, state, self.states,
+                                                self._get_arc_cost_getter(lattice_constraint_names))
+            for arc in arcs:
+                self.add_arc(arc)
+            self.arcs_by_state_and_symbol[key] = arcs
+        return self.arcs_by_state_and_symbol[key]
+
+    def _get_arc_cost_getter(self, lattice_constraint_names):
+        """ returns a get_arc_cost that ranks the costs of a lattice made with lattice_constraint_names by
+        self.constraint_names (None when the orders are the same) """
+        if lattice_constraint_names == self.constraint_names:
+            return None
+        key = tuple(lattice_constraint_names)
+        if key not in self.arc_cost_getters:
+            permutation = get_ranking_permutation(lattice_constraint_names, self.constraint_names)
+            packed_costs = dict()
+
+            def get_arc_cost(arc):
+                cost_vector = arc.cost_vector
+                if cost_vector not in packed_costs:
+                    packed_costs[cost_vector] = PackedCostVector.from_counts([cost_vector.vector[i]
+                                                                              for i in permutation])
+                return packed_costs[cost_vector]
+
+            self.arc_cost_getters[key] = get_arc_cost
+        return self.arc_cost_getters[key]
+
+    def compute_arcs_in_processes(self):
+        """ computes the arcs that were not asked for yet in the process pool, when parallel_optimal_paths_flag is
+        set. The arcs are added in the order that _compute_all_arcs adds them; the arcs that raise
+        FreeEpenthesisError are left to get_arcs_reading, which raises it when they are asked for. """
+        if not parallel_optimal_paths_flag or self.all_arcs_computed:
+            return
+        segments = [segment for segment in self.alphabet
+                    if any((state, segment.get_symbol()) not in self.arcs_by_state_and_symbol for state in self.states)]
+        if not segments:
+            return
+        arcs_descriptions_by_symbol = _get_optimal_arcs_descriptions_in_processes(self.constraint_set_transducer,
+                                                                                  segments, self.feature_table)
+        for segment in segments:
+            symbol = segment.get_symbol()
+            for state, arcs_descriptions in zip(self.states, arcs_descriptions_by_symbol[symbol]):
+                key = (state, symbol)
+                if key in self.arcs_by_state_and_symbol or isinstance(arcs_descriptions, FreeEpenthesisError):
+                    continue
+                arcs = _make_described_arcs(state, segment, arcs_descriptions, self.states)
+                for arc in arcs:
+                    self.add_arc(arc)
+                self.arcs_by_state_and_symbol[key] = arcs
+
+    def _compute_all_arcs(self):
+        if not self.all_arcs_computed:
+            self.compute_arcs_in_processes()
+            for segment in self.alphabet:
+                for state in self.states:
+                    self.get_arcs_reading(state, segment.get_symbol())
+            self.all_arcs_computed = True
+
+    def _get_arc_index(self):
+        return _LazyGrammarArcIndex(self)
+
+    def get_arcs(self):
+        self._compute_all_arcs()
+        return Transducer.get_arcs(self)
+
+    def get_arcs_by_origin_state(self, origin_state):
+        self._compute_all_arcs()
+        return Transducer.get_arcs_by_origin_state(self, origin_state)
+
+    def get_arcs_by_terminal_state(self, terminal_state):
+        self._compute_all_arcs()
+        return Transducer.get_arcs_by_terminal_state(self, terminal_state)
+
+    def get_arcs_by_origin_and_terminal_state(self, origin_state, terminal_state):
+        self._compute_all_arcs()
+        return Transducer.get_arcs_by_origin_and_terminal_state(self, origin_state, terminal_state)
+
+    def get_range(self):
+        self._compute_all_arcs()
+        return Transducer.get_range(self)
+
+    def clone(self):
+        self._compute_all_arcs()
+        return Transducer.clone(self)
+
+    def dot_representation(self):
+        self._compute_all_arcs()
+        return Transducer.dot_representation(self)
+
+    def __str__(self):
+        self._compute_all_arcs()
+        return Transducer.__str__(self)
+
+    def __eq__(self, other):
+        self._compute_all_arcs()
+        return Transducer.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class _LazyGrammarArcIndex:
+    """ the arc index that Transducer.intersection uses, over the arcs of a LazyGrammarTransducer that were asked
+    for - all the inputs of its arcs are segments of the alphabet """
+    __slots__ = ["transducer"]
+
+    def __init__(self, transducer):
+        self.transducer = transducer
+
+    def get_matching_arcs(self, state, input, output):
+        if isinstance(input, set) or input == JOKER_SEGMENT:
+            return self.transducer.get_arcs_by_origin_state(state)
+        symbol = input.get_symbol()
+        if symbol not in self.transducer.segment_by_symbol:
+            return ()
+        return self.transducer.get_arcs_reading(state, symbol)
+
+
+def _get_optimal_arcs_from_state(intersected_machine, word_transducer, segment, state1, states, get_arc_cost=None):
+    """ One single-source pass that makes the arcs of make_optimal_paths from state1 to every state2 at once:
+    the optimal costs from word_initial & state1 are found for all the states of intersected_machine, the
+    arcs on optimal paths are kept, and the outputs of those paths are collected for every state along them.
+    An arc to state2 carries the outputs and cost of the optimal paths to word_final & state2.
+    Costs are read with get_arc_cost, as in _get_optimal_costs.
+    Raises FreeEpenthesisError when the optimal paths have a cycle, as they then have infinitely many outputs.
+    """
+    if get_arc_cost is None:
+        get_arc_cost = _get_packed_arc_cost
+    initial_state = word_transducer.initial_state & state1
+    costs = _get_optimal_costs(intersected_machine, initial_state, get_arc_cost=get_arc_cost)
+    optimal_arcs_by_state = {state: [arc for arc in intersected_machine.get_arcs_by_origin_state(state)
+                                     if cost + get_arc_cost(arc) == costs[arc.terminal_state]]
+                             for state, cost in iteritems(costs)}
+
+    strings_by_state = {state: set() for state in costs}
+    strings_by_state[initial_state].add('')
+    try:
+        topological_order = _get_topological_order(optimal_arcs_by_state)
+    except TransducerOptimizationError:
+        raise FreeEpenthesisError("reading {0} from {1} has infinitely many optimal outputs: the optimal paths "
+                                  "have an epenthesis cycle that costs nothing".format(segment.get_symbol(), state1))
+    for state in topological_order:
+        state_strings = strings_by_state[state]
+        for arc in optimal_arcs_by_state[state]:
+            terminal_strings = strings_by_state[arc.terminal_state]
+            for string2 in intersected_machine.get_output_strings(arc):
+                for string1 in state_strings:
+                    terminal_strings.add(string1 + string2)
+
+    word_final_state = word_transducer.get_a_final_state()
+    arcs = list()
+    for state2 in states:
+        final_state = word_final_state & state2
+        if final_state in costs:
+            arcs.append(Arc(state1, segment, strings_by_state[final_state], costs[final_state].unpack(), state2))
+    return arcs
+
+
+def _get_optimal_costs(transducer, source_state, get_arc_cost=None):
+    """ returns the most harmonic (packed) cost from source_state of every state reachable from it. An acyclic machine is relaxed once in topological order; otherwise a Dijkstra search
+    runs over a heap, with ties broken by the order in which states were reached.
+    The cost of an arc is its packed cost vector, or get_arc_cost(arc) when it is given.
+    """
+    if get_arc_cost is None:
+        get_arc_cost = _get_packed_arc_cost
+
+    arcs_by_state = dict()
+    states_queue = [source_state]
+    for state in states_queue:  # states_queue grows while it is walked
+        arcs_by_state[state] = transducer.get_arcs_by_origin_state(state)
+        for arc in arcs_by_state[state]:
+            if arc.terminal_state not in arcs_by_state:
+                arcs_by_state[arc.terminal_state] = None
+                states_queue.append(arc.terminal_state)
+
+    zero_vector = PackedCostVector.get_zero(transducer.get_length_of_cost_vectors())
+    costs = {source_state: zero_vector}
+    try:
+        topological_order = _get_topological_order(arcs_by_state)
+    except TransducerOptimizationError:
+        topological_order = None
+
+    if topological_order is not None:
+        for state in topological_order:
+            cost = costs[state]
+            for arc in arcs_by_state[state]:
+                terminal_cost = cost + get_arc_cost(arc)
+                if arc.terminal_state not in costs or terminal_cost < costs[arc.terminal_state]:
+                    costs[arc.terminal_state] = terminal_cost
+        return costs
+
+    done_states = set()
+    order = itertools.count()
+    heap = [(zero_vector, next(order), source_state)]
+    while heap:
+        cost, _, state = heappop(heap)
+        if state in done_states:
+            continue
+        done_states.add(state)
+        for arc in arcs_by_state[state]:
+            terminal_state = arc.terminal_state
+            terminal_cost = cost + get_arc_cost(arc)
+            if terminal_state not in costs or terminal_cost < costs[terminal_state]:
+                costs[terminal_state] = terminal_cost
+                heappush(heap, (terminal_cost, next(order), terminal_state))
+    return costs
+
+
+def _get_packed_arc_cost(arc):
+    return arc.cost_vector.get_packed()
+
+
+def _get_topological_order(arcs_by_state):
+    in_degrees = {state: 0 for state in arcs_by_state}
+    for arcs in itervalues(arcs_by_state):
+        for arc in arcs:
+            in_degrees[arc.terminal_state] += 1
+    order = [state for state, in_degree in iteritems(in_degrees) if in_degree == 0]
+    for state in order:  # order grows while it is walked
+        for arc in arcs_by_state[state]:
+            in_degrees[arc.terminal_state] -= 1
+            if in_degrees[arc.terminal_state] == 0:
+                order.append(arc.terminal_state)
+    if len(order) != len(arcs_by_state):
+        raise TransducerOptimizationError('Cyclic Transducer')
+    return order
+
+
 def _best_arcs(arcs_from_current_index, state_costs):
     best_arcs_by_state = {}
     for arc in arcs_from_current_index:
-        current_cost = state_costs[arc.origin_state] + arc.cost_vector
-        if arc.terminal_state in best_arcs_by_state.keys():
+        current_cost = state_costs[arc.origin_state] + arc.cost_vector.get_packed()
+        if arc.terminal_state in best_arcs_by_state:
             terminus_cost = state_costs[arc.terminal_state]
-            if current_cost > terminus_cost:
+            if current_cost < terminus_cost:
                 best_arcs_by_state[arc.terminal_state] = [arc]
                 state_costs[arc.terminal_state] = current_cost
             elif current_cost == terminus_cost:
@@ -148,20 +559,20 @@ def optimize_transducer_grammar_for_word(word, eval):
     state_costs = {}
     new_transducer.add_state(eval.initial_state)
     new_transducer.initial_state = eval.initial_state
-    state_costs[eval.initial_state] = CostVector.get_vector(eval.get_length_of_cost_vectors(), 0)
+    state_costs[eval.initial_state] = PackedCostVector.get_zero(eval.get_length_of_cost_vectors())
 
     for index in range(len(word.get_segments())):
         new_arcs = _best_arcs(arcs_by_index[index], state_costs)
         for arc in new_arcs:
             new_transducer.add_arc(arc)
             new_transducer.add_state(arc.terminal_state)
-            state_costs[arc.terminal_state] = state_costs[arc.origin_state] + arc.cost_vector
+            state_costs[arc.terminal_state] = state_costs[arc.origin_state] + arc.cost_vector.get_packed()
 
     new_final_states = [eval.final_states[0]]
     for state in eval.final_states[1:]:
         state_cost = state_costs[state]
         final_cost = state_costs[new_final_states[0]]
-        if state_cost > final_cost:
+        if state_cost < final_cost:
             new_final_states = [state]
         elif state_cost == final_cost:
             new_final_states.append(state)
@@ -174,3 +585,126 @@ def optimize_transducer_grammar_for_word(word, eval):
     return new_transducer
 
 
+def get_ranking_permutation(constraint_names, reranked_constraint_names):
+    """ returns the permutation that ranks the costs of constraint_names as reranked_constraint_names: the i-th
+    name of reranked_constraint_names is the permutation[i]-th name of constraint_names.
+    Equal names are matched with distinct positions (in the order they appear), so they keep distinct costs.
+    """
+    positions_by_name = dict()
+    for position, name in enumerate(constraint_names):
+        positions_by_name.setdefault(name, list()).append(position)
+    for positions in itervalues(positions_by_name):
+        positions.reverse()
+    return [positions_by_name[name].pop() for name in reranked_constraint_names]
+
+
+def make_word_lattice(word, grammar_transducer):
+    """ Makes the transducer that optimize_transducer_grammar_for_word makes from the intersection of the word
+    transducer and the grammar transducer, without making the intersection: a Viterbi pass walks the segments of
+    the word over the grammar transducer, keeping for every (position, state) the most harmonic arcs into it,
+    and the most harmonic states at the end of the word are made final.
+    States are labeled and indexed as the states of the intersection are.
+
+    :type word: Word
+    :type grammar_transducer: Transducer
+    :rtype: Transducer
+    """
+    arc_index = grammar_transducer._get_arc_index()
+    costs = _get_initial_costs(grammar_transducer)
+    steps = list()
+    for segment in word.get_segments():
+        costs, best_arcs_by_state = _read_segment(arc_index, costs, segment)
+        steps.append((segment, best_arcs_by_state))
+    return _build_word_lattice(grammar_transducer, steps, costs)
+
+
+def make_word_lattices(words, grammar_transducer):
+    """ make_word_lattice for many words: the words are put in a trie of their segments, and the trie is walked
+    over the grammar transducer, so the Viterbi pass over a prefix that some words share is made once.
+    Every lattice is identical to the one make_word_lattice makes for its word.
+
+    :type words: iterable of Words
+    :type grammar_transducer: Transducer
+    :rtype: dict: word string -> Transducer
+    """
+    return dict(iterate_word_lattices(words, grammar_transducer))
+
+
+def iterate_word_lattices(words, grammar_transducer):
+    """ yields the (word string, lattice) pairs of make_word_lattices one at a time, as the walk over the trie
+    reaches the words - a caller that keeps them in a bounded cache can drop old entries as the new ones come """
+    trie = dict()  # segment -> sub trie; the words that end at a node are listed under None
+    for word in words:
+        node = trie
+        for segment in word.get_segments():
+            node = node.setdefault(segment, dict())
+        node.setdefault(None, list()).append(word)
+
+    arc_index = grammar_transducer._get_arc_index()
+    nodes_to_walk = [(trie, _get_initial_costs(grammar_transducer), ())]
+    while nodes_to_walk:
+        node, costs, steps = nodes_to_walk.pop()
+        for segment, sub_trie in iteritems(node):
+            if segment is None:
+                lattice = _build_word_lattice(grammar_transducer, steps, costs)
+                for word in sub_trie:
+                    yield str(word), lattice
+            else:
+                next_costs, best_arcs_by_state = _read_segment(arc_index, costs, segment)
+                nodes_to_walk.append((sub_trie, next_costs, steps + ((segment, best_arcs_by_state),)))
+
+
+def _get_initial_costs(grammar_transducer):
+    return {grammar_transducer.initial_state: PackedCostVector.get_zero(
+        grammar_transducer.get_length_of_cost_vectors())}
+
+
+def _read_segment(arc_index, costs, segment):
+    """ one step of the Viterbi pass: the most harmonic cost of every state reached by reading segment from the
+    states in costs, and the (origin state, arc) pairs that reach it with that cost """
+    best_arcs_by_state = dict()
+    next_costs = dict()
+    for state, cost in iteritems(costs):
+        for arc in arc_index.get_matching_arcs(state, segment, JOKER_SEGMENT):
+            if Segment.intersect(segment, arc.input) is None:
+                continue
+            terminal_state = arc.terminal_state
+            terminal_cost = cost + arc.cost_vector.get_packed()
+            if terminal_state not in next_costs or terminal_cost < next_costs[terminal_state]:
+                next_costs[terminal_state] = terminal_cost
+                best_arcs_by_state[terminal_state] = [(state, arc)]
+            elif terminal_cost == next_costs[terminal_state]:
+                best_arcs_by_state[terminal_state].append((state, arc))
+    return next_costs, best_arcs_by_state
+
+
+def _build_word_lattice(grammar_transducer, steps, costs):
+    """ makes the lattice of the Viterbi steps of a word - (segment, best_arcs_by_state) for every position -
+    where costs are the costs of the states reached at the end of the word """
+    lattice = Transducer(grammar_transducer.get_alphabet())
+
+    def get_lattice_state(position, state):
+        return State("q{0}|{1}".format(position, state.label), max(position, state.index))
+
+    initial_state = grammar_transducer.initial_state
+    lattice.initial_state = get_lattice_state(0, initial_state)
+    lattice.add_state(lattice.initial_state)
+    lattice_states = {initial_state: lattice.initial_state}
+
+    for position, (segment, best_arcs_by_state) in enumerate(steps):
+        next_lattice_states = dict()
+        for terminal_state, best_arcs in iteritems(best_arcs_by_state):
+            lattice_state = get_lattice_state(position + 1, terminal_state)
+            next_lattice_states[terminal_state] = lattice_state
+            lattice.add_state(lattice_state)
+            for state, arc in best_arcs:
+                lattice.add_arc(Arc(lattice_states[state], segment, Segment.intersect(JOKER_SEGMENT, arc.output),
+                                    arc.cost_vector, lattice_state))
+        lattice_states = next_lattice_states
+
+    final_costs = [(costs[state], lattice_states[state]) for state in grammar_transducer.get_final_states()
+                   if state in costs]
+    if final_costs:
+        most_harmonic_cost = min(cost for cost, _ in final_costs)
+        lattice.set_final_states([lattice_state for cost, lattice_state in final_costs if cost == most_harmonic_cost])
+    return lattice
@@ -1,6 +1,7 @@
 import logging
 from math import ceil, log
 import pickle
+from transducer import make_strings_trie
 from otml_configuration_manager import OtmlConfigurationManager, OtmlConfigurationError
 
 
@@ -14,6 +15,7 @@ class TraversableGrammarHypothesis:
     def __init__(self, grammar, data):
         self.grammar = grammar
         self.data = data
+        self.data_trie = None  # made once, and shared with the copies of the hypothesis
         self.data_parse = None
         self.grammar_energy = None
         self.data_energy = None
@@ -102,13 +104,16 @@ class TraversableGrammarHypothesis:
         """
         data_parse_dict = {word: set() for word in self.data}
         lexicon_word_set = set(self.grammar.lexicon.get_words())
+        if self.data_trie is None:
+            self.data_trie = make_strings_trie(data_parse_dict)
+        # outputs are counted and looked up in the data, not listed
+        selected_outputs_by_word = self.grammar.select_words_outputs(lexicon_word_set, self.data_trie)
         for word_in_lexicon in lexicon_word_set:
-            outputs = self.grammar.generate(word_in_lexicon)  # outputs in a list of Words
+            outputs, outputs_in_data = selected_outputs_by_word[word_in_lexicon]
             number_of_outputs = len(outputs)
-            for output in outputs:
-                if output in self.data:
-                    parse = (word_in_lexicon, number_of_outputs)
-                    data_parse_dict[output].add(parse)
+            for output in outputs_in_data:
+                parse = (word_in_lexicon, number_of_outputs)
+                data_parse_dict[output].add(parse)
         return data_parse_dict
 
     def encode_output(self, parse, input_choice_length):
@@ -123,7 +128,9 @@ class TraversableGrammarHypothesis:
 
     def get_hypothesis_copy(self):
         grammar_copy = pickle.loads(pickle.dumps(self.grammar, -1))
-        return TraversableGrammarHypothesis(grammar_copy, self.data)
+        hypothesis_copy = TraversableGrammarHypothesis(grammar_copy, self.data)
+        hypothesis_copy.data_trie = self.data_trie
+        return hypothesis_copy
 
     def __str__(self):
         return "Hypothesis with energy: {0}".format(self.get_energy())